@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+# multiset stems and affixes of a whole lexicon at once, with numpy
+# Jackson Lee
+
+try:
+    import numpy
+except ImportError: # numpy is optional; MultisetLexicon is not available without it
+    numpy = None
+
+#####################################################
+
+BLOCK_FORMS = 4096 # number of forms whose letters are counted at a time
+
+#####################################################
+
+###########################
+## Class MultisetLexicon ##
+###########################
+
+class MultisetLexicon(object):
+    '''Multiset stems and affixes of all the paradigms of a lexicon,
+    computed together with array operations instead of row by row.
+
+    rows is a list of data rows as read from a .csv file (leaf first),
+    all with the same number of forms. Every form is encoded as a vector
+    of letter counts, giving the array self.counts of shape
+    (rows, columns, letters); the letters (self.alphabet) are sorted as
+    in multisetString. Then
+
+        self.stemCounts = minimum of counts over the columns of each row
+        self.affixCounts = counts - stemCounts
+
+    so that stems()[i] and affixes()[i] are what Stemplex(rows[i], ...)
+    has in MyStemList[0] and MyAffixes.'''
+
+    def __init__(self, rows):
+        if numpy is None:
+            raise ImportError('MultisetLexicon needs numpy')
+        if not rows:
+            raise ValueError('no rows')
+
+        self.nRows = len(rows)
+        self.nColumns = len(rows[0]) - 1
+        forms = list()
+        for (i, row) in enumerate(rows):
+            if len(row) - 1 != self.nColumns:
+                raise ValueError('row %d has %d forms instead of %d' % (i, len(row) - 1, self.nColumns))
+            forms += row[1:]
+
+        # the index in self.alphabet of every character of all forms
+        joined = ''.join(forms)
+        if isinstance(joined, str):
+            # byte strings: through a table of the 256 possible bytes
+            codes = numpy.frombuffer(joined, dtype=numpy.uint8)
+            present = numpy.bincount(codes, minlength=256) > 0
+            self.letterCodes = numpy.flatnonzero(present).astype(numpy.uint8)
+            self.alphabet = [chr(x) for x in self.letterCodes]
+            letterIndex = (numpy.cumsum(present) - 1)[codes]
+        else:
+            self.letterCodes = None
+            self.alphabet = sorted(set(joined))
+            indexDict = dict([(l, i) for (i, l) in enumerate(self.alphabet)])
+            letterIndex = numpy.array([indexDict[l] for l in joined], dtype=numpy.intp)
+        nLetters = max(len(self.alphabet), 1)
+
+        # count vectors, a block of forms at a time to keep bincount's array small
+        formLengths = numpy.array([len(x) for x in forms], dtype=numpy.intp)
+        formEnds = numpy.cumsum(formLengths)
+        formIndex = numpy.repeat(numpy.arange(len(forms)), formLengths)
+        dtype = numpy.uint8 if formLengths.max() < 256 else numpy.uint16
+        counts = numpy.zeros((len(forms), nLetters), dtype=dtype)
+        for a in range(0, len(forms), BLOCK_FORMS):
+            b = min(a + BLOCK_FORMS, len(forms))
+            (start, end) = (formEnds[a] - formLengths[a], formEnds[b - 1])
+            keys = (formIndex[start:end] - a) * nLetters + letterIndex[start:end]
+            counts[a:b] = numpy.bincount(keys, minlength=(b - a) * nLetters).reshape(b - a, nLetters)
+        self.counts = counts.reshape(self.nRows, self.nColumns, nLetters)
+
+        self.stemCounts = self.counts.min(axis=1)
+        self.affixCounts = self.counts - self.stemCounts[:, numpy.newaxis, :]
+
+    #class MultisetLexicon-----------------------------------------------------#
+
+    def countStrings(self, counts):
+        '''takes an array of count vectors (letters on the last axis) and
+        returns the list of the alphabetized strings they represent'''
+        counts = counts.reshape(-1, counts.shape[-1])
+        if counts.shape[-1] != len(self.alphabet): # no letters at all
+            return [''] * counts.shape[0]
+        if self.letterCodes is not None:
+            joined = numpy.repeat(numpy.tile(self.letterCodes, counts.shape[0]), counts.ravel()).tostring()
+        else:
+            letters = numpy.array(self.alphabet, dtype=object)
+            joined = ''.join(numpy.repeat(numpy.tile(letters, counts.shape[0]), counts.ravel()))
+        ends = numpy.cumsum(counts.sum(axis=1, dtype=numpy.intp)).tolist()
+        starts = [0] + ends[:-1]
+        return [joined[s:e] for (s, e) in zip(starts, ends)]
+
+    def stems(self):
+        'list of the multiset stems of all rows'
+        return self.countStrings(self.stemCounts)
+
+    def affixes(self):
+        'list of the lists of multiset affixes of all rows'
+        affixList = self.countStrings(self.affixCounts)
+        return [affixList[i: i + self.nColumns] for i in range(0, len(affixList), self.nColumns)]
+
+    #class MultisetLexicon-----------------------------------------------------#
+
+    def unionAffixCounts(self, rowIndices):
+        'count vectors of the union affixes (per-column maximum) of the given rows'
+        return self.affixCounts[list(rowIndices)].max(axis=0)
+
+    def unionAffixes(self, rowIndices):
+        '''list of the union affixes of the given rows, as createUnionAffixes
+        gives for the affixes of their stemplexes'''
+        return self.countStrings(self.unionAffixCounts(rowIndices))
@@ -0,0 +1,262 @@
+#!/usr/bin/python
+
+# benchmarks for Stemplex construction and the stem extraction strategies,
+# on the sample .csv files and on synthetic paradigms
+# Jackson Lee
+
+import os
+import sys
+import glob
+import json
+import time
+import random
+import string
+import platform
+import subprocess
+from timeit import default_timer as timer
+from stemplex import Stemplex, ENGINE_VERSION
+import stemBatch
+
+#####################################################
+
+SAMPLE_FILES = ['arabicVerbs21.csv', 'englishverbsCOCA100phonemes-comma.csv',
+                'spanishPresentIndicative.csv', 'tagalogVerbTemp.csv']
+
+# synthetic paradigm settings benchmarked by default
+SYNTHETIC_SPECS = ['length=5,columns=6,alphabet=20,repetition=0,pattern=suffix,rows=50',
+                   'length=8,columns=6,alphabet=20,repetition=0,pattern=suffix,rows=50',
+                   'length=8,columns=20,alphabet=10,repetition=0.3,pattern=infix,rows=30',
+                   'length=8,columns=20,alphabet=6,repetition=0.5,pattern=reduplication,rows=30',
+                   'length=12,columns=10,alphabet=4,repetition=0.5,pattern=mixed,rows=20']
+
+SYNTHETIC_DEFAULTS = {'length': 6, 'columns': 6, 'alphabet': 20, 'repetition': 0.0,
+                      'pattern': 'suffix', 'rows': 50, 'seed': 0}
+
+PATTERNS = ['suffix', 'prefix', 'infix', 'reduplication']
+
+# (name, Stemplex method, keyword arguments)
+METHODS = [('substring', 'extractStemSubstring', {}),
+           ('multiset', 'extractStemMultiset', {}),
+           ('subsequence', 'extractStemSubsequence', {})]
+
+REFERENCE_METHODS = [('substring-enumerate', 'extractStemSubstring', {'engine': 'enumerate'}),
+                     ('subsequence-enumerate', 'extractStemSubsequence', {'engine': 'enumerate'})]
+
+#####################################################
+
+###############
+## Functions ##
+###############
+
+#----------------------------------------------------------------#
+
+def parseSpec(spec):
+    '''takes "key=value,key=value,..." and returns the settings of a synthetic
+    data set, with SYNTHETIC_DEFAULTS for the keys not given'''
+    settings = dict(SYNTHETIC_DEFAULTS)
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        (key, value) = item.split('=')
+        key = key.strip()
+        if key not in SYNTHETIC_DEFAULTS:
+            raise ValueError('unknown synthetic setting: %s' % (key))
+        settings[key] = type(SYNTHETIC_DEFAULTS[key])(value.strip())
+    if settings['pattern'] not in PATTERNS + ['mixed']:
+        raise ValueError('unknown pattern: %s' % (settings['pattern']))
+    if not 1 <= settings['alphabet'] <= len(string.ascii_lowercase):
+        raise ValueError('alphabet size must be from 1 to %d' % (len(string.ascii_lowercase)))
+    return settings
+
+#----------------------------------------------------------------#
+
+def syntheticParadigm(rng, length, columns, alphabet, repetition, pattern):
+    '''generates one paradigm as a data row (leaf first):
+    a root of "length" letters from the first "alphabet" letters of a-z,
+    in which each letter repeats an earlier letter of the root with
+    probability "repetition", combined in each of the "columns" forms
+    with an affix of one to three letters according to "pattern"
+    (suffix, prefix, infix, reduplication, or mixed = any of these per form)'''
+    letters = string.ascii_lowercase[:alphabet]
+    root = ''
+    for i in range(length):
+        if root and rng.random() < repetition:
+            root += rng.choice(root)
+        else:
+            root += rng.choice(letters)
+
+    forms = list()
+    for k in range(columns):
+        affix = ''.join([rng.choice(letters) for i in range(rng.randint(1, 3))])
+        formPattern = rng.choice(PATTERNS) if pattern == 'mixed' else pattern
+        if formPattern == 'suffix':
+            forms.append(root + affix)
+        elif formPattern == 'prefix':
+            forms.append(affix + root)
+        elif formPattern == 'infix':
+            forms.append(root[:1] + affix + root[1:])
+        else: # reduplication of the first two letters, as in Tagalog
+            forms.append(root[:2] + root + affix)
+    return [root] + forms
+
+def syntheticParadigms(settings):
+    'generates the rows of a synthetic data set from parseSpec settings'
+    rng = random.Random(settings['seed'])
+    return [syntheticParadigm(rng, settings['length'], settings['columns'], settings['alphabet'],
+                              settings['repetition'], settings['pattern'])
+            for i in range(settings['rows'])]
+
+#----------------------------------------------------------------#
+
+def countAlignments(result):
+    'number of index tuples in the result of an extractStem* method (reads lazy results)'
+    return sum([len(list(indexTuplesList))
+                for indexTuplesMasterList in result.values()
+                for indexTuplesList in indexTuplesMasterList])
+
+def benchmarkRows(rows, methods=METHODS, slowRow=1.0):
+    '''times Stemplex construction (with the RowIndex that all methods on
+    the row share) and each method on every row; returns
+    {"rows", "columns", "construction": {...}, method name: {...}} where each
+    entry has the total, mean and maximum seconds per row, the slowest row
+    and, for methods, the number of stems and index tuples found; rows taking
+    more than slowRow seconds are listed under "slowRows"; with numpy,
+    "multisetBatch" has the seconds MultisetLexicon takes for all the rows'''
+    nColumns = len(rows[0]) - 1
+    timings = dict([(name, list()) for name in ['construction'] + [x[0] for x in methods]])
+    counts = dict([(name, [0, 0]) for (name, methodName, kwargs) in methods])
+
+    for (i, row) in enumerate(rows):
+        start = timer()
+        stmplx = Stemplex(row, i, nColumns)
+        rowIndex = stmplx.rowIndex()
+        timings['construction'].append(timer() - start)
+
+        for (name, methodName, kwargs) in methods:
+            start = timer()
+            result = getattr(stmplx, methodName)(rowIndex=rowIndex, **kwargs)
+            nAlignments = countAlignments(result)
+            timings[name].append(timer() - start)
+            counts[name][0] += len(result)
+            counts[name][1] += nAlignments
+
+    report = {'rows': len(rows), 'columns': nColumns}
+    for (name, seconds) in timings.items():
+        slowest = max(range(len(seconds)), key=lambda x: seconds[x])
+        entry = {'totalSeconds': sum(seconds),
+                 'meanSeconds': sum(seconds) / len(seconds),
+                 'maxSeconds': seconds[slowest],
+                 'slowestRow': slowest,
+                 'slowestLeaf': rows[slowest][0],
+                 'slowRows': [k for (k, x) in enumerate(seconds) if x > slowRow]}
+        if name in counts:
+            (entry['stems'], entry['alignments']) = counts[name]
+        report[name] = entry
+
+    if stemBatch.numpy is not None:
+        start = timer()
+        lexicon = stemBatch.MultisetLexicon(rows)
+        lexicon.stems()
+        lexicon.affixes()
+        report['multisetBatch'] = {'totalSeconds': timer() - start}
+    return report
+
+#----------------------------------------------------------------#
+
+def environment():
+    'what the benchmark ran on, so that reports from different commits can be compared'
+    info = {'engineVersion': ENGINE_VERSION,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())}
+    try:
+        info['commit'] = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        info['commit'] = None
+    return info
+
+#----------------------------------------------------------------#
+
+def benchmark(csvFiles=None, specs=None, reference=False, slowRow=1.0, log=sys.stderr):
+    '''runs benchmarkRows on each .csv file and each synthetic spec and returns
+    the whole report; reference=True also times the reference enumerators'''
+    methods = METHODS + (REFERENCE_METHODS if reference else [])
+    report = {'environment': environment(), 'datasets': list()}
+
+    for fname in csvFiles or list():
+        rows = [x.replace('\n','').replace('\r','').split(',') for x in open(fname) if x.strip()]
+        log.write('%s (%d rows)...\n' % (fname, len(rows)))
+        result = benchmarkRows(rows, methods, slowRow)
+        result['name'] = os.path.basename(fname)
+        report['datasets'].append(result)
+
+    for spec in specs or list():
+        settings = parseSpec(spec)
+        log.write('synthetic %s...\n' % (spec))
+        result = benchmarkRows(syntheticParadigms(settings), methods, slowRow)
+        result['name'] = 'synthetic'
+        result['settings'] = settings
+        report['datasets'].append(result)
+
+    return report
+
+#----------------------------------------------------------------#
+
+def printSummary(report, outfile=sys.stdout):
+    names = ['construction'] + [name for (name, methodName, kwargs) in METHODS + REFERENCE_METHODS]
+    for dataset in report['datasets']:
+        label = dataset['name']
+        if 'settings' in dataset:
+            label += ' ' + ','.join(['%s=%s' % (k, dataset['settings'][k])
+                                     for k in sorted(dataset['settings'])])
+        outfile.write('%s\n' % (label))
+        for name in names:
+            if name not in dataset:
+                continue
+            entry = dataset[name]
+            outfile.write('    %-22s total %9.4fs   max/row %9.4fs (%s)\n' %
+                          (name, entry['totalSeconds'], entry['maxSeconds'], entry['slowestLeaf']))
+        if 'multisetBatch' in dataset:
+            outfile.write('    %-22s total %9.4fs\n' % ('multiset batch', dataset['multisetBatch']['totalSeconds']))
+
+#----------------------------------------------------------------#
+
+def commandLine(argv=None):
+    'python stemBench.py [options]'
+    import argparse
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(
+        description='time Stemplex construction and the stem extraction strategies')
+    parser.add_argument('--csv', nargs='*', default=None, metavar='CSV',
+                        help='.csv data files (default: the sample files; none if given without files)')
+    parser.add_argument('--synthetic', nargs='*', default=None, metavar='SPEC',
+                        help='synthetic data sets as key=value,... with keys %s '
+                             '(default: a built-in set; none if given without specs)' %
+                             (', '.join(sorted(SYNTHETIC_DEFAULTS))))
+    parser.add_argument('--reference', action='store_true',
+                        help='also time the reference (enumerating) engines')
+    parser.add_argument('--slow-row', type=float, default=1.0,
+                        help='seconds above which a row is listed as slow (default: %(default)s)')
+    parser.add_argument('-o', '--output', default=None,
+                        help='write the JSON report to this file (default: bench-<time>.json)')
+    args = parser.parse_args(argv)
+
+    csvFiles = args.csv
+    if csvFiles is None:
+        csvFiles = [os.path.join(here, x) for x in SAMPLE_FILES]
+    else:
+        csvFiles = [x for pattern in csvFiles for x in sorted(glob.glob(pattern))]
+    specs = SYNTHETIC_SPECS if args.synthetic is None else args.synthetic
+
+    report = benchmark(csvFiles, specs, args.reference, args.slow_row)
+    outputFilename = args.output or 'bench-%s.json' % (time.strftime("%Y-%m-%d-%H-%M-%S", time.localtime()))
+    json.dump(report, open(outputFilename, 'w'), indent=1, sort_keys=True)
+
+    printSummary(report)
+    print '\nReport written to %s' % (outputFilename)
+
+if __name__ == '__main__':
+    commandLine()
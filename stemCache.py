@@ -0,0 +1,270 @@
+#!/usr/bin/python
+
+# on-disk and in-memory caches of stem extraction results
+# Jackson Lee
+
+import os
+import collections
+import errno
+import hashlib
+import cPickle as pickle
+from stemplex import ENGINE_VERSION
+
+#####################################################
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.stemExtract', 'cache')
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024 # in bytes
+SHARDS = 256 # subdirectories of the cache directory, named after the first two hex digits of keys
+
+#####################################################
+
+#######################
+## Class ResultCache ##
+#######################
+
+class ResultCache(object):
+    '''Results of extractStemSubstring, extractStemMultiset and
+    extractStemSubsequence stored on disk, one file per result.
+
+    A result is keyed by a hash of the paradigm's forms (columns 1..n),
+    the strategy name and ENGINE_VERSION, so a row that has not changed
+    since the last run is found again regardless of where it is in the
+    data file, and results from older engines are never reused.
+
+    The files are spread over SHARDS subdirectories by key, and each
+    shard may take up maxBytes / SHARDS: when a shard grows beyond that,
+    its least recently used files (by modification time, which is
+    refreshed on every hit) are deleted until it is back under 90% of
+    its share. The size of a shard is read from disk the first time a
+    process writes to it and then kept up to date by that process, so
+    the cache directory is never scanned as a whole; with several worker
+    processes sharing a directory the limit is approximate.
+
+    Results with more than maxResultAlignments index tuples are not
+    cached (see extractParadigm), so that caching never reads a large
+    lazily generated result into memory.'''
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, maxBytes=DEFAULT_CACHE_SIZE,
+                 maxResultAlignments=100000):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.maxResultAlignments = maxResultAlignments
+        self.hits = 0
+        self.misses = 0
+        self.shardBytes = dict() # shard directory => bytes, for the shards written to
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    #class ResultCache---------------------------------------------------------#
+
+    def key(self, forms, strategy):
+        'hash of (forms, strategy, engine version); forms may also be tuples of segments'
+        h = hashlib.sha1()
+        if any([isinstance(x, tuple) for x in forms]): # forms cut into segments
+            h.update('segments\x1d' + '\x1f'.join(['\x1d'.join(x) for x in forms]))
+        else:
+            h.update('\x1f'.join(forms))
+        h.update('\x1e' + strategy + '\x1e' + ENGINE_VERSION)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:] + '.pickle')
+
+    def entries(self, shard):
+        'list of (modification time, size, path) for the files in a shard directory'
+        result = list()
+        try:
+            filenames = os.listdir(shard)
+        except OSError:
+            return result
+        for filename in filenames:
+            path = os.path.join(shard, filename)
+            try:
+                stat = os.stat(path)
+            except OSError: # removed by another process meanwhile
+                continue
+            result.append((stat.st_mtime, stat.st_size, path))
+        return result
+
+    #class ResultCache---------------------------------------------------------#
+
+    def get(self, forms, strategy):
+        'returns the cached result, or None if there is none'
+        path = self.path(self.key(forms, strategy))
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+            os.utime(path, None) # mark as recently used
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, forms, strategy, result):
+        path = self.path(self.key(forms, strategy))
+        shard = os.path.dirname(path)
+        if not os.path.isdir(shard):
+            try:
+                os.makedirs(shard)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        if shard not in self.shardBytes:
+            self.shardBytes[shard] = sum([size for (mtime, size, x) in self.entries(shard)])
+        try:
+            self.shardBytes[shard] -= os.path.getsize(path) # replaced
+        except OSError:
+            pass
+
+        # write to a temporary file first so that readers never see half a file
+        tempPath = '%s.%d.tmp' % (path, os.getpid())
+        with open(tempPath, 'wb') as f:
+            pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tempPath, path)
+
+        self.shardBytes[shard] += os.path.getsize(path)
+        if self.shardBytes[shard] > self.maxBytes / SHARDS:
+            self.evict(shard)
+
+    #class ResultCache---------------------------------------------------------#
+
+    def evict(self, shard):
+        'deletes the least recently used files of a shard until it is under 90% of its share'
+        entryList = sorted(self.entries(shard))
+        self.shardBytes[shard] = sum([size for (mtime, size, path) in entryList])
+        for (mtime, size, path) in entryList:
+            if self.shardBytes[shard] <= 0.9 * self.maxBytes / SHARDS:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.shardBytes[shard] -= size
+
+    def clear(self):
+        '''deletes the files of the cache (results, and temporary files being written,
+        in the shard subdirectories), leaving anything else in the directory alone'''
+        for name in os.listdir(self.directory):
+            shard = os.path.join(self.directory, name)
+            if len(name) != 2 or name.strip('0123456789abcdef') or not os.path.isdir(shard):
+                continue
+            for filename in os.listdir(shard):
+                if filename.endswith('.pickle') or filename.endswith('.tmp'):
+                    try:
+                        os.remove(os.path.join(shard, filename))
+                    except OSError: # removed by another process meanwhile
+                        pass
+            try:
+                os.rmdir(shard) # unless something else is in it
+            except OSError:
+                pass
+        self.shardBytes = dict()
+
+#####################################################
+
+########################
+## Class ParadigmMemo ##
+########################
+
+class ParadigmMemo(object):
+    '''Results of extractStemSubstring, extractStemMultiset and
+    extractStemSubsequence kept in memory for the current run, so that
+    rows with identical forms (columns 1..n), such as homographs with
+    different glosses in column 0, are computed only once.
+
+    With renaming=True, rows that are identical up to a consistent
+    renaming of letters (e.g. the same template with a different root)
+    also share their substring and subsequence results: these are stored
+    in terms of the order in which letters first appear in the row, and
+    translated back into the letters of the row asking for them. This is
+    only done for results with a single stem: the order in which several
+    stems are listed depends on the letters themselves. For the same
+    reason multiset results are only shared between identical rows.
+
+    Results are plain lists of index tuples; lazily generated results are
+    not memoized (see extractParadigm). A result with more than
+    maxResultAlignments index tuples is not kept, and at most maxEntries
+    results holding at most maxAlignments index tuples in all are kept;
+    the least recently used ones are dropped first.'''
+
+    RENAMING_STRATEGIES = ('substring', 'subsequence')
+
+    def __init__(self, renaming=False, maxEntries=100000, maxAlignments=1000000,
+                 maxResultAlignments=10000):
+        self.renaming = renaming
+        self.maxEntries = maxEntries
+        self.maxAlignments = maxAlignments
+        self.maxResultAlignments = maxResultAlignments
+        self.results = collections.OrderedDict() # key => (result, number of index tuples)
+        self.alignments = 0 # number of index tuples in all results kept
+        self.hits = 0
+        self.misses = 0
+
+    #class ParadigmMemo--------------------------------------------------------#
+
+    def canonical(self, forms):
+        '''returns (forms with every letter replaced by the number of distinct
+        letters seen before it in the row, list of letters by number)'''
+        numbers = dict()
+        letters = list()
+        canonicalForms = list()
+        for form in forms:
+            canonicalForm = list()
+            for l in form:
+                if l not in numbers:
+                    numbers[l] = len(letters)
+                    letters.append(l)
+                canonicalForm.append(numbers[l])
+            canonicalForms.append(tuple(canonicalForm))
+        return (tuple(canonicalForms), letters, numbers)
+
+    def keys(self, forms, strategy):
+        'the keys a result is found under, most specific first'
+        keyList = [(strategy, tuple(forms))]
+        if self.renaming and strategy in self.RENAMING_STRATEGIES:
+            keyList.append((strategy, 'renaming', self.canonical(forms)[0]))
+        return keyList
+
+    #class ParadigmMemo--------------------------------------------------------#
+
+    def get(self, forms, strategy):
+        'returns the memoized result, or None if there is none'
+        for key in self.keys(forms, strategy):
+            if key not in self.results:
+                continue
+            (result, size) = self.results.pop(key)
+            self.results[key] = (result, size) # mark as recently used
+            self.hits += 1
+            if key[1] != 'renaming':
+                return result
+            letters = self.canonical(forms)[1]
+            return [(''.join([letters[n] for n in stem]), indexTuplesMasterList)
+                    for (stem, indexTuplesMasterList) in result]
+        self.misses += 1
+        return None
+
+    def put(self, forms, strategy, result):
+        size = sum([len(indexTuplesList) for (stem, indexTuplesMasterList) in result
+                    for indexTuplesList in indexTuplesMasterList])
+        if size > self.maxResultAlignments:
+            return
+        for key in self.keys(forms, strategy):
+            if key[1] == 'renaming':
+                if len(result) != 1:
+                    continue
+                numbers = self.canonical(forms)[2]
+                storedResult = [(tuple([numbers[l] for l in stem]), indexTuplesMasterList)
+                                for (stem, indexTuplesMasterList) in result]
+            else:
+                storedResult = result
+            if key in self.results:
+                self.alignments -= self.results.pop(key)[1]
+            self.results[key] = (storedResult, size)
+            self.alignments += size
+        while len(self.results) > self.maxEntries or self.alignments > self.maxAlignments:
+            self.alignments -= self.results.popitem(last=False)[1][1]
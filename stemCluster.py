@@ -0,0 +1,384 @@
+#!/usr/bin/python
+
+# bottom-up clustering of paradigms by MDL cost savings
+# Jackson Lee
+
+import sys
+import heapq
+import logging
+from stemplex import *
+
+try:
+    import numpy
+except ImportError: # numpy is optional; without it, merge costs come from Stemplex.mergeCosts
+    numpy = None
+
+log = logging.getLogger('stemExtract.cluster')
+
+#####################################################
+
+########################
+## Class ClusterCosts ##
+########################
+
+class ClusterCosts(object):
+    '''Summaries of clusters of stemplexes from which the total cost of
+    merging any two of them follows in O(columns x letters), whatever
+    the size of the clusters (numpy needed).
+
+    In the cost matrix of a stem s with target T in column k, where the
+    affix is U (count vectors; see costArrays in stemplex.py), the letters
+    of T not covered by s, R = T - min(T, s), do not depend on U, and
+
+        cost = STEM_USED*|min(T,s)| + STEM_NOT_USED*(|s| - |min(T,s)|) + EXTRA*|R|
+               + AFFIX_NOT_USED*|U| + (AFFIX_USED - AFFIX_NOT_USED - EXTRA)*|min(R, U)|
+
+    Summed over the stems of a cluster, the first line is a constant
+    (self.fixed) and the last term only needs, for each column and letter,
+    table[k, l, u] = sum over the stems of min(R[k, l], u). When two clusters
+    are merged, their constants, numbers of stems, stem lengths and tables
+    add up (the columns of the right one permuted by the alignment) and the
+    affixes are the per-letter maxima, as Stemplex.merge() has them.
+
+    Clusters are numbered as in clusterStemplexes: the stemplexes first,
+    then the merged clusters in the order they are made.'''
+
+    def __init__(self, stemplexList):
+        self.nColumns = stemplexList[0].numColumns
+        nStemplexes = len(stemplexList)
+        size = 2 * nStemplexes - 1
+
+        # all stems with their targets, and the stemplex each one belongs to
+        stemList = list()
+        targetsList = list()
+        owners = list()
+        for (i, stmplx) in enumerate(stemplexList):
+            stemList += stmplx.stems()
+            targetsList += stmplx.targets()
+            owners += [i] * len(stmplx.stems())
+        affixesList = [stmplx.affixes() for stmplx in stemplexList]
+
+        letterIndex = letterIndexOf(stemList + [''.join(x) for x in targetsList + affixesList])
+        nLetters = max(len(letterIndex), 1)
+        stemCounts = countArray(stemList, letterIndex).reshape(len(stemList), 1, nLetters)
+        targetCounts = numpy.array([countArray(x, letterIndex) for x in targetsList]).reshape(
+            len(stemList), self.nColumns, nLetters)
+        stemUsed = numpy.minimum(targetCounts, stemCounts)
+        residue = targetCounts - stemUsed
+        maxCount = max(int(targetCounts.max()) if targetCounts.size else 0, 1)
+
+        self.stemLength = numpy.zeros(size, dtype=int)
+        self.nStems = numpy.zeros(size, dtype=int)
+        self.fixed = numpy.zeros(size, dtype=int)
+        self.affixCounts = numpy.zeros((size, self.nColumns, nLetters), dtype=numpy.int32)
+        self.table = numpy.zeros((size, self.nColumns, nLetters, maxCount + 1), dtype=numpy.int32)
+
+        stemLengths = stemCounts.sum(axis=(1, 2))
+        stemUsedSum = stemUsed.sum(axis=-1)
+        numpy.add.at(self.stemLength, owners, stemLengths)
+        numpy.add.at(self.nStems, owners, 1)
+        numpy.add.at(self.fixed, owners, (STEM_USED * stemUsedSum +
+                                          STEM_NOT_USED * (stemLengths[:, numpy.newaxis] - stemUsedSum) +
+                                          EXTRA * residue.sum(axis=-1)).sum(axis=-1))
+        numpy.add.at(self.table, owners, numpy.minimum(residue[..., numpy.newaxis], numpy.arange(maxCount + 1)))
+        self.affixCounts[:nStemplexes] = numpy.array([countArray(x, letterIndex) for x in affixesList]).reshape(
+            nStemplexes, self.nColumns, nLetters)
+        self.totals = numpy.zeros(size, dtype=int)
+        self.totals[:nStemplexes] = self.costs(self.stemLength[:nStemplexes], self.nStems[:nStemplexes],
+                                               self.fixed[:nStemplexes], self.affixCounts[:nStemplexes],
+                                               self.table[:nStemplexes])
+
+    #class ClusterCosts--------------------------------------------------------#
+
+    def costs(self, stemLength, nStems, fixed, affixCounts, table):
+        'total costs of clusters given their summaries, as arrays over the clusters'
+        affixLength = affixCounts.sum(axis=(1, 2))
+        covered = numpy.take_along_axis(table, affixCounts[..., numpy.newaxis], axis=-1).sum(axis=(1, 2, 3))
+        return (LAMBDA_BITS * (stemLength + affixLength + self.nColumns) + fixed +
+                AFFIX_NOT_USED * nStems * affixLength + (AFFIX_USED - AFFIX_NOT_USED - EXTRA) * covered)
+
+    def savings(self, lefts, right, alignments):
+        '''costs saved by merging cluster "right" into each cluster of the list
+        "lefts", with the columns of "right" aligned by the matching alignment
+        of the list "alignments" (or by "alignments" itself for all of them,
+        if it is a single alignment)'''
+        lefts = numpy.array(lefts, dtype=int)
+        alignments = numpy.array(alignments, dtype=int)
+        mergedCosts = self.costs(self.stemLength[lefts] + self.stemLength[right],
+                                 self.nStems[lefts] + self.nStems[right],
+                                 self.fixed[lefts] + self.fixed[right],
+                                 numpy.maximum(self.affixCounts[lefts], self.affixCounts[right][alignments]),
+                                 self.table[lefts] + self.table[right][alignments])
+        return (self.totals[lefts] + self.totals[right] - mergedCosts).tolist()
+
+    def columnCosts(self, lefts, right):
+        '''returns the array of shape (len(lefts), columns, columns) whose [p, a, b]
+        is what column a of lefts[p] and column b of "right" add to the total
+        cost when merged into the same column; with an alignment, the total cost
+        of a merge is then
+            LAMBDA_BITS * (stem lengths + columns) + fixed costs
+            + sum over the columns a of [p, a, alignment[a]]'''
+        lefts = numpy.array(lefts, dtype=int)
+        rightAffixCounts = self.affixCounts[right][numpy.newaxis, numpy.newaxis]
+        unionCounts = numpy.maximum(self.affixCounts[lefts][:, :, numpy.newaxis], rightAffixCounts)
+        unionLength = unionCounts.sum(axis=-1)
+        index = unionCounts[..., numpy.newaxis]
+        covered = (numpy.take_along_axis(self.table[lefts][:, :, numpy.newaxis], index, axis=-1) +
+                   numpy.take_along_axis(self.table[right][numpy.newaxis, numpy.newaxis], index, axis=-1))
+        nStems = (self.nStems[lefts] + self.nStems[right])[:, numpy.newaxis, numpy.newaxis]
+        return ((LAMBDA_BITS + AFFIX_NOT_USED * nStems) * unionLength +
+                (AFFIX_USED - AFFIX_NOT_USED - EXTRA) * covered.sum(axis=(-2, -1)))
+
+    def optimalAlignments(self, lefts, right):
+        '''for merging cluster "right" into each cluster of the list "lefts",
+        returns the list of (cost saved, alignment) with the alignment of the
+        columns of "right" that saves the most (see optimalAssignment)'''
+        result = list()
+        # a block of lefts at a time, so that the arrays of columnCosts stay small
+        blockSize = max(1, 2 ** 20 // (self.table[0].size * self.nColumns))
+        for start in range(0, len(lefts), blockSize):
+            block = lefts[start: start + blockSize]
+            columnCostsList = self.columnCosts(block, right).tolist()
+            for (left, columnCosts) in zip(block, columnCostsList):
+                alignment = optimalAssignment(columnCosts)
+                mergedCost = (LAMBDA_BITS * (self.stemLength[left] + self.stemLength[right] + self.nColumns) +
+                              self.fixed[left] + self.fixed[right] +
+                              sum([columnCosts[a][b] for (a, b) in enumerate(alignment)]))
+                result.append((int(self.totals[left] + self.totals[right] - mergedCost), alignment))
+        return result
+
+    def merge(self, left, right, alignment, merged):
+        'makes the summary of cluster "merged", which is "right" merged into "left"'
+        self.stemLength[merged] = self.stemLength[left] + self.stemLength[right]
+        self.nStems[merged] = self.nStems[left] + self.nStems[right]
+        self.fixed[merged] = self.fixed[left] + self.fixed[right]
+        self.affixCounts[merged] = numpy.maximum(self.affixCounts[left], self.affixCounts[right][alignment])
+        self.table[merged] = self.table[left] + self.table[right][alignment]
+        self.totals[merged] = self.costs(self.stemLength[[merged]], self.nStems[[merged]],
+                                         self.fixed[[merged]], self.affixCounts[[merged]],
+                                         self.table[[merged]])[0]
+
+#####################################################
+
+###############
+## Functions ##
+###############
+
+#----------------------------------------------------------------#
+
+def optimalAssignment(costMatrix):
+    '''takes a square matrix (list of lists) and returns the assignment of
+    columns to rows, as the list of the column of each row, with the least
+    total cost; among assignments of equal cost, one with as many rows
+    assigned to their own column as possible
+
+    Hungarian algorithm with row and column potentials, O(n^3).'''
+    n = len(costMatrix)
+    # scaling by n+1 and taking 1 off the diagonal breaks ties in favour of
+    # keeping columns in place without changing which assignments are cheapest
+    costMatrix = [[x * (n + 1) - (i == j) for (j, x) in enumerate(row)]
+                  for (i, row) in enumerate(costMatrix)]
+    infinity = float('inf')
+    u = [0] * (n + 1) # row potentials
+    v = [0] * (n + 1) # column potentials
+    rowOf = [0] * (n + 1) # rowOf[j] = row (1-based) assigned to column j, 0 = none
+    way = [0] * (n + 1)
+    for i in range(1, n + 1):
+        rowOf[0] = i
+        j0 = 0
+        minimum = [infinity] * (n + 1)
+        used = [False] * (n + 1)
+        while True:
+            used[j0] = True
+            i0 = rowOf[j0]
+            delta = infinity
+            j1 = 0
+            for j in range(1, n + 1):
+                if not used[j]:
+                    current = costMatrix[i0 - 1][j - 1] - u[i0] - v[j]
+                    if current < minimum[j]:
+                        minimum[j] = current
+                        way[j] = j0
+                    if minimum[j] < delta:
+                        delta = minimum[j]
+                        j1 = j
+            for j in range(n + 1):
+                if used[j]:
+                    u[rowOf[j]] += delta
+                    v[j] -= delta
+                else:
+                    minimum[j] -= delta
+            j0 = j1
+            if rowOf[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            rowOf[j0] = rowOf[j1]
+            j0 = j1
+
+    columnOf = [0] * n
+    for j in range(1, n + 1):
+        columnOf[rowOf[j] - 1] = j - 1
+    return columnOf
+
+#----------------------------------------------------------------#
+
+# An alignment finder takes two stemplexes and returns (alignment, cost saved),
+# where the alignment is that of the columns of the second stemplex for merging
+# it into the first (newAlignment in Stemplex.merge()), and the cost saved is the
+# sum of their total costs minus the total cost of the merged stemplex.
+
+def identityAlignment(stmplx1, stmplx2):
+    'the columns of two stemplexes are aligned as they are in the data'
+    newAlignment = range(stmplx1.numColumns)
+    mergedCost = stmplx1.mergeCosts(stmplx2, [newAlignment])[0]
+    return (newAlignment, stmplx1.totalCost() + stmplx2.totalCost() - mergedCost)
+
+def optimalAlignment(stmplx1, stmplx2):
+    '''the columns of two stemplexes are aligned so that merging them saves
+    the most cost: the total cost of a merge is a constant plus what each pair
+    of merged columns adds, so the best alignment is an optimal assignment of
+    the columns of stmplx2 to those of stmplx1 (polynomial in the number of
+    columns, where trying all alignments would be factorial)'''
+    if numpy is not None:
+        (saving, newAlignment) = ClusterCosts([stmplx1, stmplx2]).optimalAlignments([0], 1)[0]
+        return (newAlignment, saving)
+
+    nColumns = stmplx1.numColumns
+    columnCosts = [[0] * nColumns for a in range(nColumns)]
+    for a in range(nColumns):
+        for b in range(nColumns):
+            unionAffix = createUnionAffixes([[stmplx1.affixes()[a]], [stmplx2.affixes()[b]]])[0]
+            columnCosts[a][b] = LAMBDA_BITS * len(unionAffix) + \
+                sum([sum(cost(stem, unionAffix, targets[a]))
+                     for (stem, targets) in zip(stmplx1.stems(), stmplx1.targets())]) + \
+                sum([sum(cost(stem, unionAffix, targets[b]))
+                     for (stem, targets) in zip(stmplx2.stems(), stmplx2.targets())])
+    newAlignment = optimalAssignment(columnCosts)
+    mergedCost = LAMBDA_BITS * (len(''.join(stmplx1.stems() + stmplx2.stems())) + nColumns) + \
+                 sum([columnCosts[a][b] for (a, b) in enumerate(newAlignment)])
+    return (newAlignment, stmplx1.totalCost() + stmplx2.totalCost() - mergedCost)
+
+#----------------------------------------------------------------#
+
+def clusterStemplexes(stemplexList, alignmentFinder=identityAlignment):
+    '''merges the stemplexes of stemplexList bottom-up, each time the two
+    clusters whose merge saves the most cost (the least, if none saves
+    anything), until one is left; returns (the merged stemplex, nodeDict),
+    where nodeDict = {merge number: TreeNode} of its merge tree, or (None, {})
+    for no stemplexes
+
+    The stemplexes are merged in place: the left one of each merge takes in
+    the right one. The cost savings of all pairs of clusters are kept in a
+    heap; after a merge, only the pairs involving the new cluster are
+    computed, and the pairs involving its two daughters are dropped as they
+    come off the heap (or all at once, when they are most of the heap).
+    With numpy, the savings come from ClusterCosts and those of a new
+    cluster with all the others are computed together.
+    alignmentFinder (identityAlignment, optimalAlignment or any function
+    of the same kind) gives the alignment of the columns of each pair and
+    the cost saved.'''
+    if not stemplexList:
+        return (None, dict())
+
+    clusterDict = dict(enumerate(stemplexList)) # cluster id => stemplex, for clusters not yet merged
+    clusterCosts = ClusterCosts(stemplexList) if numpy is not None else None
+
+    identity = range(stemplexList[0].numColumns)
+
+    def pairs(lefts, right):
+        'list of (-cost saved, left, right, alignment) for merging right into each of lefts'
+        if clusterCosts is None or not lefts or \
+           alignmentFinder not in (identityAlignment, optimalAlignment):
+            savingList = [(saving, alignment) for (alignment, saving)
+                          in [alignmentFinder(clusterDict[left], clusterDict[right]) for left in lefts]]
+        elif alignmentFinder is identityAlignment:
+            savingList = [(saving, identity) for saving in clusterCosts.savings(lefts, right, identity)]
+        else:
+            savingList = clusterCosts.optimalAlignments(lefts, right)
+        return [(-saving, left, right, alignment)
+                for (left, (saving, alignment)) in zip(lefts, savingList)]
+
+    heap = list()
+    for j in range(1, len(stemplexList)):
+        heap += pairs(range(j), j)
+    heapq.heapify(heap)
+
+    nextClusterId = len(stemplexList)
+    lastMerge = len(stemplexList) - 1
+
+    for mergeCount in range(1, lastMerge + 1):
+        # once most pairs in the heap involve clusters already merged, drop them all at once
+        nClusters = len(clusterDict)
+        if len(heap) > nClusters * (nClusters - 1):
+            heap = [x for x in heap if x[1] in clusterDict and x[2] in clusterDict]
+            heapq.heapify(heap)
+
+        while True:
+            (negativeSaving, i, j, newAlignment) = heapq.heappop(heap)
+            if i in clusterDict and j in clusterDict:
+                break
+        left = clusterDict.pop(i)
+        right = clusterDict.pop(j)
+        costSaved = -negativeSaving
+
+        log.debug('merge %d: %s + %s, cost saved %s', mergeCount,
+                  left.leaves(), right.leaves(), costSaved)
+        left.merge(right, newAlignment, mergeCount, costSaved)
+        if clusterCosts is not None:
+            clusterCosts.merge(i, j, newAlignment, nextClusterId)
+
+        clusterDict[nextClusterId] = left
+        for pair in pairs(sorted(k for k in clusterDict if k != nextClusterId), nextClusterId):
+            heapq.heappush(heap, pair)
+        nextClusterId += 1
+
+    stmplx = clusterDict.values()[0]
+    nodeDict = dict([(node.MyIndex, node) for node in stmplx.treeNode().nodes() if not node.isLeaf()])
+    return (stmplx, nodeDict)
+
+#----------------------------------------------------------------#
+
+def clusterParadigms(rows, alignmentFinder=identityAlignment):
+    '''takes data rows (leaf first), builds their stemplexes and returns
+    clusterStemplexes(stemplexes, alignmentFinder)'''
+    return clusterStemplexes([Stemplex(row, i, len(row) - 1) for (i, row) in enumerate(rows)],
+                             alignmentFinder)
+
+#----------------------------------------------------------------#
+
+def commandLine(argv=None):
+    'python stemCluster.py file.csv: prints the merge tree of the paradigms and its costs'
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='cluster the paradigms of a .csv data file by MDL cost savings')
+    parser.add_argument('file', metavar='CSV', help='.csv data file')
+    parser.add_argument('-a', '--align', action='store_true',
+                        help='align the columns of each merge optimally instead of as in the data')
+    parser.add_argument('-s', '--segments', default=None,
+                        help='comma-separated segments written with several characters '
+                             '(e.g. aa,uu,th), each of which counts as one letter')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log every merge')
+    args = parser.parse_args(argv)
+
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG, format='%(message)s')
+    rows = [x.replace('\n','').replace('\r','').split(',') for x in open(args.file) if x.strip()]
+    if args.segments is not None:
+        segments = SegmentInventory([x for x in args.segments.split(',') if x])
+        (rows, table) = segments.encodeRows(rows) # one set of symbols for all rows
+    (stmplx, nodeDict) = clusterParadigms(rows, optimalAlignment if args.align else identityAlignment)
+    if stmplx is None:
+        print 'No data in file'
+        return 1
+
+    print 'Tree:', stmplx.tree()
+    print 'Bare tree:', stmplx.bareTree()
+    print 'Collapsed tree:', stmplx.collapsedTree()
+    print 'Grammar cost: %d, data cost: %d, total cost: %d' % \
+          (stmplx.grammarCost(), stmplx.dataCost(), stmplx.totalCost())
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(commandLine())
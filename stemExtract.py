@@ -5,10 +5,20 @@
 # Jackson Lee
 
 import sys
-import subprocess
 import os
 import time
+import itertools
+import collections
+import multiprocessing
+import logging
+from timeit import default_timer as timer
 from stemplex import *
+from stemOutput import *
+import stemBatch
+from stemCache import ResultCache, ParadigmMemo, DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE
+from stemMetrics import Metrics, JsonFileSink
+
+log = logging.getLogger('stemExtract')
 
 
 
@@ -44,65 +54,306 @@ def sublist(L, indices):
 
 #----------------------------------------------------------------#
 
-def improvedSourceWord(sourceWord, bestIndexList):
-    # to color-code the stem, prefix, infix, and suffix in the "improvedSourceWord"
-    # in the surface word, the best stem characters are in black
-    s = ''
-    for (k,c) in enumerate(sourceWord):
-        if k not in bestIndexList:
-            # if c is an affix letter
-
-            # check where c is
-            # (on all stem letters' left-hand side? on the right? or sandwiched in-between?)
-            stemLetterPreceding = False
-            stemLetterFollowing = False
-            for j in bestIndexList:
-                if j < k:
-                    stemLetterPreceding = True
-                    break
-            for j in bestIndexList:
-                if j > k:
-                    stemLetterFollowing = True
-                    break
-
-            if stemLetterPreceding and stemLetterFollowing:
-                s += '{\\bf \\color{OliveGreen}' + c + '}'
-            elif stemLetterPreceding:
-                s += '{\\bf \\color{Blue}' + c + '}'
-            elif stemLetterFollowing:
-                s += '{\\bf \\color{Red}' + c + '}'
+def readParadigms(fname, delimiter=','):
+    'reads the data file one row at a time and yields each row as a list of fields, skipping blank lines'
+    for x in open(fname):
+        if x.strip():
+            yield x.replace('\n','').replace('\r','').split(delimiter)
+
+#----------------------------------------------------------------#
+
+# (strategy, Stemplex method, whether the method can generate index tuples lazily)
+STRATEGIES = [('substring', 'extractStemSubstring', False),
+              ('multiset', 'extractStemMultiset', True),
+              ('subsequence', 'extractStemSubsequence', True)]
+
+STRATEGY_NAMES = tuple([strategy for (strategy, methodName, canBeLazy) in STRATEGIES])
+
+def readAlignments(improvedDictItems, maxAlignments=None):
+    '''reads the index tuples of [(stem, indexTuplesMasterList), ...] into lists
+    and returns (the result, number of index tuples), unless there are more
+    than maxAlignments (None = no limit): then reading stops at
+    maxAlignments + 1, and the result keeps what was read followed by the
+    index tuples not yet generated'''
+    count = 0
+    isComplete = True
+    result = list()
+    for (stem, indexTuplesMasterList) in improvedDictItems:
+        masterList = list()
+        for indexTuples in indexTuplesMasterList:
+            if isComplete:
+                indexTuples = iter(indexTuples)
+                if maxAlignments is None:
+                    indexTupleList = list(indexTuples)
+                else:
+                    indexTupleList = list(itertools.islice(indexTuples, maxAlignments - count + 1))
+                count += len(indexTupleList)
+                if maxAlignments is not None and count > maxAlignments:
+                    isComplete = False
+                    indexTuples = itertools.chain(indexTupleList, indexTuples)
+                else:
+                    indexTuples = indexTupleList
+            masterList.append(indexTuples)
+        result.append((stem, masterList))
+    return (result, count)
+
+def extractParadigm(paradigm, lazy=False, cache=None, memo=None, strategies=STRATEGY_NAMES,
+                    instrument=False, limits=None, segments=None, multiset=None):
+    '''takes (row, row number, number of columns), builds the stemplex, runs the
+    stem extraction strategies on it and returns (leaf, source row,
+    [(strategy, [(stem, indexTuplesMasterList), ...]), ...], record, notes);
+    lazy=False gives plain lists so that the results can be sent between processes;
+    cache = a ResultCache to look results up in and store them to (None = no caching);
+    with lazy=True, only the first cache.maxResultAlignments index tuples of a
+    result are read to decide whether to cache it;
+    memo = a ParadigmMemo for rows already seen in this run (None = no memo),
+    not used when lazy=True;
+    strategies = which of STRATEGY_NAMES to run;
+    instrument = True: record is the paradigm's metrics record (see stemMetrics.py),
+    otherwise None; with lazy=True, the index tuples of the results are counted,
+    and the time spent generating them added to the record, as they are read, so
+    the record is only complete once the results have been read;
+    limits = (seconds, candidates) allowed to this paradigm, shared by its strategies
+    in turn (see stemplex.Budget; either may be None for no limit), or None = no limits;
+    with limits, results are plain lists, strategies that run out fall back to
+    something cheaper, notes = {strategy: Budget.marker} says which did and
+    how, and their results are neither cached nor memoized;
+    segments = a SegmentInventory (see stemplex.py) to encode the row with
+    (None = every character is a letter), in which case the source row is
+    given as tuples of segments, stems are decoded back into the data, and
+    cached results are keyed on the segments of the forms;
+    multiset = (multiset stem, multiset affixes) of the row if already known
+    (see multisetsOf), so that the stemplex does not compute them again'''
+    (row, rowNumber, nColumns) = paradigm
+    table = None
+    if segments is not None:
+        (row, table) = segments.encodeRow(row)
+        paradigm = (row, rowNumber, nColumns)
+    sourceRow = row[1:]
+    cacheForms = sourceRow
+    if table is not None:
+        cacheForms = [segments.segments(x, table) for x in sourceRow]
+
+    if lazy:
+        # lazily generated results can only be read once, so they are not shared
+        memo = None
+    if limits is not None:
+        lazy = False
+    notes = dict()
+
+    record = None
+    if instrument:
+        paradigmStart = timer()
+        record = {'row': rowNumber, 'leaf': row[0], 'constructionSeconds': 0.0,
+                  'strategies': dict()}
+
+    # the stemplex (and the RowIndex its strategies share, which is dropped with it
+    # when this returns) is only built if some result is neither memoized nor cached
+    stmplx = None
+    rowIndex = None
+    strategyResults = list()
+    budget = None
+    if limits is not None:
+        budget = Budget(*limits)
+    for (strategy, methodName, canBeLazy) in STRATEGIES:
+        if strategy not in strategies:
+            continue
+
+        counters = None
+        if instrument:
+            start = timer()
+            counters = {'candidates': 0, 'combinations': 0, 'memoHits': 0, 'cacheHits': 0,
+                        'budgetExceeded': 0}
+            source = 'computed'
+
+        if budget is not None:
+            budget.marker = None # what is spent carries over, what fell back does not
+
+        if cache is None and memo is None:
+            if stmplx is None:
+                stmplx = Stemplex(*paradigm, multiset=multiset)
+                rowIndex = stmplx.rowIndex()
+                if instrument:
+                    record['constructionSeconds'] = timer() - start
+            if canBeLazy:
+                result = getattr(stmplx, methodName)(lazy=lazy, counters=counters, budget=budget,
+                                                     rowIndex=rowIndex).items()
             else:
-                s += '{\\bf \\color{RedOrange}' + c + '}'
+                result = getattr(stmplx, methodName)(counters=counters, budget=budget,
+                                                     rowIndex=rowIndex).items()
         else:
-            # if c is a stem letter
-            s += '{\\bf\\underline{' + c + '}}'
-    return s
+            result = None
+            if memo is not None:
+                result = memo.get(sourceRow, strategy)
+                if result is not None and instrument:
+                    source = 'memo'
+                    counters['memoHits'] = 1
+            if result is None:
+                if cache is not None:
+                    result = cache.get(cacheForms, strategy)
+                    if result is not None and instrument:
+                        source = 'cache'
+                        counters['cacheHits'] = 1
+                if result is None:
+                    if stmplx is None:
+                        stmplx = Stemplex(*paradigm, multiset=multiset)
+                        rowIndex = stmplx.rowIndex()
+                        if instrument:
+                            record['constructionSeconds'] = timer() - start
+                    if canBeLazy:
+                        result = getattr(stmplx, methodName)(lazy=lazy, counters=counters, budget=budget,
+                                                             rowIndex=rowIndex).items()
+                    else:
+                        result = getattr(stmplx, methodName)(counters=counters, budget=budget,
+                                                             rowIndex=rowIndex).items()
+                    (result, nAlignments) = readAlignments(
+                        result, cache.maxResultAlignments if lazy and cache is not None else None)
+                    if cache is not None and nAlignments <= cache.maxResultAlignments \
+                       and (budget is None or budget.marker is None):
+                        cache.put(cacheForms, strategy, result)
+                if memo is not None and (budget is None or budget.marker is None):
+                    memo.put(sourceRow, strategy, result)
+
+        if budget is not None and budget.marker is not None:
+            notes[strategy] = budget.marker
+            if instrument:
+                counters['budgetExceeded'] = 1
+                counters['budget'] = budget.marker
+
+        if instrument and lazy:
+            # counted (and timed) as they are read, e.g. by the output writers
+            counters['alignments'] = 0
+            result = [(stem, [countedAlignments(indexTuplesList, counters, record)
+                              for indexTuplesList in indexTuplesMasterList])
+                      for (stem, indexTuplesMasterList) in result]
+        elif instrument:
+            counters['alignments'] = sum([len(indexTuplesList)
+                                          for (stem, indexTuplesMasterList) in result
+                                          for indexTuplesList in indexTuplesMasterList])
+        if instrument:
+            counters['seconds'] = timer() - start
+            counters['source'] = source
+            record['strategies'][strategy] = counters
+        strategyResults.append((strategy, result))
+
+    if table is not None:
+        # back from segment symbols to the segments of the data
+        sourceRow = cacheForms
+        strategyResults = [(strategy, [(segments.decode(stem, table), indexTuplesMasterList)
+                                       for (stem, indexTuplesMasterList) in improvedDictItems])
+                           for (strategy, improvedDictItems) in strategyResults]
+
+    if instrument:
+        record['seconds'] = timer() - paradigmStart
+    return (row[0], sourceRow, strategyResults, record, notes)
+
+def multisetsOf(paradigmList, segments=None):
+    '''the (multiset stem, multiset affixes) of each of a list of paradigms,
+    computed for all of them at once with stemBatch.MultisetLexicon; None for
+    each (every stemplex computes its own) without numpy, with segments (rows
+    are encoded one at a time by extractParadigm) or if the rows do not all
+    have the same number of forms'''
+    if stemBatch.numpy is None or segments is not None or not paradigmList:
+        return [None] * len(paradigmList)
+    try:
+        lexicon = stemBatch.MultisetLexicon([row for (row, rowNumber, nColumns) in paradigmList])
+    except ValueError:
+        return [None] * len(paradigmList)
+    return zip(lexicon.stems(), lexicon.affixes())
+
+def countedAlignments(indexTuples, counters, record):
+    '''generates the index tuples of a lazy result, adding their number to
+    counters['alignments'] and the time spent generating them to
+    counters['seconds'] and record['seconds']'''
+    iterator = iter(indexTuples)
+    while True:
+        start = timer()
+        try:
+            indexTuple = next(iterator)
+        except StopIteration:
+            indexTuple = None
+        elapsed = timer() - start
+        counters['seconds'] += elapsed
+        record['seconds'] += elapsed
+        if indexTuple is None:
+            return
+        counters['alignments'] += 1
+        yield indexTuple
+
+def extractParadigmList(paradigmList, lazy=False, cache=None, memo=None, strategies=STRATEGY_NAMES,
+                        instrument=False, limits=None, segments=None):
+    'runs extractParadigm on a list of paradigms, with their multiset stems computed together'
+    return [extractParadigm(paradigm, lazy, cache, memo, strategies, instrument, limits, segments, multiset)
+            for (paradigm, multiset) in zip(paradigmList, multisetsOf(paradigmList, segments))]
+
+def extractParadigmChunk(paradigmChunk):
+    'runs extractParadigmList on a list of paradigms, in a worker process'
+    return extractParadigmList(paradigmChunk, cache=workerCache, memo=workerMemo, strategies=workerStrategies,
+                               instrument=workerInstrument, limits=workerLimits, segments=workerSegments)
+
+workerCache = None # the ResultCache of a worker process
+workerMemo = None # the ParadigmMemo of a worker process
+workerStrategies = STRATEGY_NAMES # the strategies run by a worker process
+workerInstrument = False # whether a worker process makes metrics records
+workerLimits = None # the limits of extractParadigm in a worker process
+workerSegments = None # the SegmentInventory of a worker process
+
+def initWorker(cacheDir, cacheSize, memoRenaming=None, strategies=STRATEGY_NAMES, instrument=False,
+               limits=None, segments=None):
+    '''sets up a worker process;
+    memoRenaming = None (no memo), False (identical rows) or True (also renamed rows)'''
+    global workerCache, workerMemo, workerStrategies, workerInstrument, workerLimits, workerSegments
+    workerSegments = segments
+    workerStrategies = strategies
+    workerInstrument = instrument
+    workerLimits = limits
+    if cacheDir:
+        workerCache = ResultCache(cacheDir, cacheSize)
+    if memoRenaming is not None:
+        workerMemo = ParadigmMemo(memoRenaming)
 
+#----------------------------------------------------------------#
+
+def chunks(iterable, chunksize):
+    'splits an iterable into lists of length chunksize (the last one may be shorter)'
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunksize))
+        if not chunk:
+            return
+        yield chunk
 
 #----------------------------------------------------------------#
 
-def printLatexImprovedSourceWords(latexfile, sourceRow, improvedDictItems, stemType):
-    for (k, (stem, indexTuplesMasterList)) in enumerate(improvedDictItems):
+def imapWindow(pool, func, iterable, window):
+    '''like pool.imap(func, iterable), but never has more than "window" items
+    of iterable submitted to the pool and not yet handed back, so that
+    iterable is read only as fast as the results are consumed'''
+    pending = collections.deque()
+    for x in iterable:
+        pending.append(pool.apply_async(func, (x,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
 
-        # print 'substring' (or not)
-        if k == 0:
-            latexfile.write('%s & \n' % (stemType))
-        else:
-            latexfile.write(' & \n')
-
-        # print stem
-        latexfile.write('%s & \n' % (stem))
-
-        # print improved word form
-        for (e, indexTuplesList) in enumerate(indexTuplesMasterList):
-            dboxbrString = ' \\\\ '.join([improvedSourceWord(sourceRow[e],indexTuple)
-                                          for indexTuple in indexTuplesList])
-            latexfile.write('\\dboxbr{' + dboxbrString + '}')
-            if e == (len(indexTuplesMasterList)-1):
-                latexfile.write(' \\\\ \n')
-            else:
-                latexfile.write(' & \n')
-        latexfile.write('\\midrule \n')
+#----------------------------------------------------------------#
+
+def openLog(logfilename):
+    '''sends what is logged to the "stemExtract" logger (and its children)
+    to logfilename from now on; returns the handler'''
+    open(logfilename, 'w').close()
+    # appending, so that the output of latex etc. can be added to the same file
+    handler = logging.FileHandler(logfilename, 'a')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    log.addHandler(handler)
+    if log.level == logging.NOTSET:
+        log.setLevel(logging.INFO)
+    return handler
+
+def closeLog(handler):
+    log.removeHandler(handler)
+    handler.close()
 
 #----------------------------------------------------------------#
 
@@ -110,150 +361,408 @@ def printLatexImprovedSourceWords(latexfile, sourceRow, improvedDictItems, stemT
 #### Main Program ####
 ######################
 
-def main(inputfile=None, latexfilename=None, width='8.5', height='11'):
-
-    logfilename = 'log-%s.txt' % (time.strftime("%Y-%m-%d-%H-%M-%S", time.localtime()))
-    sys.stdout = open(logfilename, 'w')
-
-    print '\nStemExtract\nBy Jackson Lee and John Goldsmith\n'
-    print '\nCurrent local time: %s' % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()))
+def main(inputfile=None, latexfilename=None, width='8.5', height='11',
+         processes=1, chunksize=16, window=256,
+         useCache=False, clearCache=False, cacheDir=DEFAULT_CACHE_DIR, cacheSize=DEFAULT_CACHE_SIZE,
+         useMemo=True, memoRenaming=False, outputFormats=('latex',),
+         compilePdf=True, viewer=False, background=False, latexChunkSize=None,
+         progress=None, cancelled=None,
+         strategies=STRATEGY_NAMES, outputDir=None, logfilename=None, metrics=None,
+         maxSeconds=None, maxCandidates=None, segments=None):
+    # processes = number of worker processes for stem extraction
+    #             (1 = serial, None = as many as there are CPUs)
+    # chunksize = number of paradigms sent to a worker process at a time, and whose
+    #             multiset stems are computed together (see multisetsOf)
+    # window = maximum number of paradigms in flight when processes != 1
+    # useCache = True: look results up in and store them to the on-disk cache (off by default)
+    # clearCache = True: empty the on-disk cache before running
+    # cacheDir, cacheSize = where the on-disk cache is, and its size limit in bytes
+    # useMemo = True: compute rows with identical forms only once in this run
+    # memoRenaming = True: also share results between rows identical up to renaming letters
+    # outputFormats = any of 'latex', 'jsonl', 'tsv', 'columnar' (see stemOutput.py);
+    #                 all output files are named after latexfilename
+    # compilePdf = False: only write the .tex file, do not run latex and dvipdf
+    # viewer = True: open the .pdf file(s) in a viewer once compiled
+    # background = True: compile in a background thread, which is returned
+    # latexChunkSize = split the LaTeX output into files of this many paradigms each
+    # progress = function called after each paradigm as
+    #            progress(row number, leaf, [(strategy, [stem, ...]), ...])
+    # cancelled = function called before each paradigm; if it returns True,
+    #             the run stops there and no .pdf is compiled
+    # strategies = which of STRATEGY_NAMES to run
+    # outputDir = directory for the output and log files (None = current directory)
+    # logfilename = name of the log file (None = log-<current time>.txt)
+    # metrics = a Metrics object (see stemMetrics.py) to hand a record of each
+    #           paradigm to (None = no instrumentation); it is not closed here
+    # maxSeconds, maxCandidates = limits on the wall time and on the number of candidates
+    #           (search states, candidate stems, index tuples) of each paradigm, over all
+    #           its strategies (None = no limit); a strategy that runs out falls back to a
+    #           cheaper result, which is marked as such in the output (see extractParadigm)
+    # segments = a SegmentInventory (see stemplex.py) to turn the forms of each row into
+    #            segment symbols (None = every character is a letter); index tuples in
+    #            the output then count segments
+
+    if not logfilename:
+        logfilename = 'log-%s.txt' % (time.strftime("%Y-%m-%d-%H-%M-%S", time.localtime()))
+    if outputDir:
+        logfilename = os.path.join(outputDir, logfilename)
+    logHandler = openLog(logfilename)
+
+    log.info('\nStemExtract\nBy Jackson Lee and John Goldsmith\n')
+    log.info('\nCurrent local time: %s', time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()))
 
     # Data source
 
-    if inputfile:
+    if isinstance(inputfile, basestring):
+        fname = inputfile
+    elif inputfile:
         fname = inputfile.name
     else:
+        closeLog(logHandler)
         return
 
     fname_bare = fname.split('/')[-1] # fname without the full path info
 
-    print '\nData file: %s' % (fname_bare)
-    print 'Reading data file...'
+    log.info('\nData file: %s', fname_bare)
+    log.info('Reading data file...')
 
-    delimiter = ','
-    source = [x.replace('\n','').replace('\r','').split(delimiter) for x in open(fname)]
+    paradigms = readParadigms(fname)
+    try:
+        firstRow = next(paradigms)
+    except StopIteration:
+        log.info('\nNo data in file')
+        closeLog(logHandler)
+        return
+    paradigms = itertools.chain([firstRow], paradigms)
 
     if not latexfilename:
         latexfilename = fname_bare[:-4] + '.tex'
     else:
         latexfilename = latexfilename + '.tex'
+    if outputDir:
+        latexfilename = os.path.join(outputDir, latexfilename)
 
-    ROWS = len(source)
-    COLUMNS = len(source[0])-1
-
-    print '\nData loaded'
+    COLUMNS = len(firstRow)-1
 
-    print '\nROWS:', ROWS
-    print 'COLUMNS:', COLUMNS
+    log.info('\nCOLUMNS: %d', COLUMNS)
 
     ################################################################################################
 
-    # initialize all stemplexes
-
-    print '\nInitializing stemplexes...'
-
-    stemplexList = []
+    # stemplexes are initialized one row at a time as the data file is read,
+    # and each row is dropped as soon as its results have been written out
 
-    for i in range(ROWS):
-        StcxComplex = Stemplex(source[i], i, COLUMNS)
-        StcxComplex.MyNodeIndex = i+ROWS
-        stemplexList.append(StcxComplex)
-
-    print 'All stemplexes initialized'
+    paradigms = ((row, i, COLUMNS) for (i, row) in enumerate(paradigms))
+    if cancelled is not None:
+        # stop reading the data file as soon as the run is cancelled
+        paradigms = itertools.takewhile(lambda x: not cancelled(), paradigms)
 
     ################################################################################################
 
-    # write the latex preamble in "latexfile"
-
-    print '\nInitializing LaTeX output file...'
+    # open the output files
 
-    latexfile = open(latexfilename, 'w')
+    log.info('\nInitializing output files...')
 
-    latexfile.write('\\documentclass{article}\n')
-    latexfile.write('\\usepackage{longtable}\n')
-    latexfile.write('\\usepackage[letterpaper, margin=.3in, '
-                    'paperwidth=%sin, paperheight=%sin]{geometry}\n' %
-                    (width, height))
-    latexfile.write('\\usepackage[usenames,dvipsnames]{color}\n')
-    latexfile.write('\\usepackage{booktabs}\n\n')
-    latexfile.write('\\usepackage{dashbox}\n\n')
-    latexfile.write('\\usepackage{minibox}\n\n')
-    latexfile.write('\\newcommand{\\dboxbr}[1]{\\framebox{\\minibox{#1}}}\n')
-    latexfile.write('\\setlength{\\parindent}{0pt}\n\n')
-
-    latexfile.write('\\begin{document}\n\n')
-    latexfile.write('\\footnotesize\n\n')
+    writerList = list()
+    for outputFormat in outputFormats:
+        writerClass = OUTPUT_WRITERS[outputFormat]
+        if writerClass is LatexWriter:
+            writerList.append(LatexWriter(latexfilename, fname_bare, COLUMNS, width, height,
+                                          latexChunkSize))
+        else:
+            writerList.append(writerClass(latexfilename[:-4] + writerClass.extension,
+                                          fname_bare, COLUMNS))
 
-    print 'LaTeX output file initialized'
+    log.info('Output files initialized: %s', ' '.join([writer.filename for writer in writerList]))
 
     ################################################################################################
 
-    # output stems and improved affixes, based on longest common subsequences
+    # output stems and improved affixes
 
-    print '\nPrinting stem identification results to LaTeX output file...'
+    log.info('\nPrinting stem identification results to output files...')
 
-    #latexfile.write('\\newpage\n\n')
-    latexfile.write('results from StemExtract\n\n')
-    latexfile.write('program created by Jackson Lee and John Goldsmith\\\\ \n\n')
-    latexfile.write('Data file: %s\n\n' % fname_bare)
-    latexfile.write(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()) + '\n\n')
+    if useCache or clearCache:
+        cache = ResultCache(cacheDir, cacheSize)
+        if clearCache:
+            cache.clear()
+            log.info('Cache cleared: %s', cacheDir)
+    if not useCache:
+        cache = None
 
+    memo = None
+    if useMemo:
+        memo = ParadigmMemo(memoRenaming)
 
-    for stmplx in stemplexList:
+    instrument = metrics is not None
 
-        # print paradigm's "leaf" in latex
-        latexfile.write('\\bf{' + stmplx.MyLeaveList[0] + '}\n\n')
+    limits = None
+    if maxSeconds is not None or maxCandidates is not None:
+        limits = (maxSeconds, maxCandidates)
+        log.info('Limits per strategy and paradigm: %s seconds, %s candidates', maxSeconds, maxCandidates)
 
-        latexfile.write('\\begin{longtable}[l]{l|c|%s}\n' % (' p{8em} ' * (COLUMNS)))
-
-        latexfile.write('\\toprule [3pt]\n')
-        stem = stmplx.stems()[0]
-        sourceRow = stmplx.sourceRows()[0]
+    if processes == 1:
+        paradigmResults = itertools.chain.from_iterable(
+            extractParadigmList(paradigmChunk, memo is None, cache, memo, strategies, instrument,
+                                limits, segments)
+            for paradigmChunk in chunks(paradigms, chunksize))
+    else:
+        pool = multiprocessing.Pool(processes, initWorker,
+                                    (cacheDir if useCache else None, cacheSize,
+                                     memoRenaming if useMemo else None, tuple(strategies),
+                                     instrument, limits, segments))
+        paradigmResults = itertools.chain.from_iterable(
+            imapWindow(pool, extractParadigmChunk, chunks(paradigms, chunksize),
+                       max(1, window // chunksize)))
+
+    ROWS = 0
+    OUT_OF_BUDGET = 0
+    isCancelled = False
+
+    for (leaf, sourceRow, strategyResults, record, notes) in paradigmResults:
+
+        if cancelled is not None and cancelled():
+            isCancelled = True
+            break
+
+        if len(writerList) > 1:
+            # lazily generated index tuples can only be read once
+            strategyResults = [(strategy, [(stem, [list(x) for x in indexTuplesMasterList])
+                                           for (stem, indexTuplesMasterList) in improvedDictItems])
+                               for (strategy, improvedDictItems) in strategyResults]
+
+        for writer in writerList:
+            writer.writeParadigm(ROWS, leaf, sourceRow, strategyResults, notes)
+        if record is not None:
+            # after writing, which reads any lazily generated index tuples (see extractParadigm)
+            metrics.emit(record)
+        for strategy in sorted(notes):
+            log.info('Row %d (%s), %s: out of budget (%s)', ROWS, leaf, strategy, notes[strategy])
+        OUT_OF_BUDGET += len(notes)
+
+        if progress is not None:
+            progress(ROWS, leaf, [(strategy, [stem for (stem, indexTuplesMasterList) in improvedDictItems])
+                                  for (strategy, improvedDictItems) in strategyResults])
+        ROWS += 1
+
+    if processes != 1:
+        if isCancelled:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
 
-        improvedStemIndicesSubstring = stmplx.extractStemSubstring().items()
-        improvedStemIndicesMultiset = stmplx.extractStemMultiset().items()
-        improvedStemIndicesSubsequence = stmplx.extractStemSubsequence().items()
+    if cancelled is not None and cancelled():
+        isCancelled = True
 
-        # based on longest common substrings
-        printLatexImprovedSourceWords(latexfile, sourceRow,
-                                      improvedStemIndicesSubstring, 'substring')
+    for writer in writerList:
+        writer.close()
 
-        # based on largest common multisets
-        printLatexImprovedSourceWords(latexfile, sourceRow,
-                                      improvedStemIndicesMultiset, 'multiset')
+    if isCancelled:
+        log.info('Cancelled; the output files only have the paradigms done so far')
+    else:
+        log.info('All done for printing stem identification results to output files')
+    log.info('\nROWS: %d', ROWS)
+    if limits is not None:
+        log.info('Strategy runs out of budget: %d', OUT_OF_BUDGET)
+    if cache is not None and processes == 1:
+        log.info('Cache hits: %d, misses: %d', cache.hits, cache.misses)
+    if memo is not None and processes == 1:
+        log.info('Memo hits: %d, misses: %d', memo.hits, memo.misses)
+    if metrics is not None:
+        for line in metrics.summary():
+            log.info(line)
 
-        # based on longest common subsequences
-        printLatexImprovedSourceWords(latexfile, sourceRow,
-                                      improvedStemIndicesSubsequence, 'subsequence')
+    ################################################################################################
 
-        latexfile.write('\\bottomrule  [3pt] \\\\ [10pt] \n')
+    # produce .pdf from .tex
 
-        latexfile.write('\\end{longtable}\n\n')
+    compileThread = None
+    if 'latex' in outputFormats and compilePdf and not isCancelled:
+        texFilenameList = writerList[list(outputFormats).index('latex')].filenames
+        if background:
+            log.info('\nCompiling output .pdf from .tex file in the background\n')
+        else:
+            log.info('\nCompiling output .pdf from .tex file\n')
 
-    latexfile.write('\\end{document}\n')
-    latexfile.close()
+        compileThread = startCompileLatex(texFilenameList, logfilename, viewer, background)
 
-    print 'All done for printing stem identification results to LaTeX output file'
+    log.info('')
+    closeLog(logHandler)
+    return compileThread
 
-    ################################################################################################
+#----------------------------------------------------------------#
 
-    # produce .tex and .pdf
+def runFile(args, wait=True):
+    '''runs main on one data file for commandLine, compiling the .pdf in a background
+    thread; returns (data file, error message or None, that thread or None);
+    wait=True (as in a worker process) waits for the thread first and gives None for it,
+    wait=False leaves it running, so that the next data file can be processed meanwhile'''
+    (fname, kwargs) = args
+    kwargs = dict(kwargs)
+    metricsFilename = kwargs.pop('metricsFilename', None)
+    metrics = None
+    if metricsFilename:
+        metrics = Metrics([JsonFileSink(metricsFilename)])
+    try:
+        compileThread = main(fname, metrics=metrics, background=True, **kwargs)
+        if wait and compileThread is not None:
+            compileThread.join()
+            compileThread = None
+    except Exception as e:
+        for handler in list(log.handlers):
+            closeLog(handler)
+        return (fname, '%s: %s' % (e.__class__.__name__, e), None)
+    finally:
+        if metrics is not None:
+            metrics.close()
+    return (fname, None, compileThread)
 
-    print '\nCompiling output .pdf from .tex file\n'
+#----------------------------------------------------------------#
 
-    commands = ['latex','latex','dvipdf']
+def commandLine(argv=None):
+    '''headless batch entry point: python stemExtract.py [options] file.csv ...'''
+    import argparse
+    import glob
+
+    parser = argparse.ArgumentParser(
+        description='StemExtract: identify the stem of each paradigm in .csv data files '
+                    'based on substrings, multisets and subsequences')
+    parser.add_argument('files', nargs='+', metavar='CSV',
+                        help='.csv data files (shell-style wildcards are expanded)')
+    parser.add_argument('-s', '--strategies', default=','.join(STRATEGY_NAMES),
+                        help='comma-separated strategies to run (default: %(default)s)')
+    parser.add_argument('-f', '--formats', default='latex',
+                        help='comma-separated output formats among %s (default: %%(default)s)' %
+                             (', '.join(sorted(OUTPUT_WRITERS))))
+    parser.add_argument('-o', '--output-dir', default='.',
+                        help='directory for output and log files (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of data files processed at the same time (default: %(default)s)')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help='number of worker processes for each data file (default: %(default)s)')
+    parser.add_argument('--no-pdf', action='store_true',
+                        help='do not compile the LaTeX output into .pdf')
+    parser.add_argument('--viewer', action='store_true',
+                        help='open the compiled .pdf files in a viewer')
+    parser.add_argument('--latex-chunk-size', type=int, default=None,
+                        help='split the LaTeX output into files of this many paradigms each')
+    parser.add_argument('--width', default='8.5', help='page width in inches (default: %(default)s)')
+    parser.add_argument('--height', default='11', help='page height in inches (default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true', help='bypass the on-disk result cache')
+    parser.add_argument('--clear-cache', action='store_true', help='empty the on-disk result cache first')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='on-disk result cache directory (default: %(default)s)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+                        help='size limit of the on-disk result cache in megabytes (default: %(default)s)')
+    parser.add_argument('--memo-renaming', action='store_true',
+                        help='share results between rows identical up to renaming letters')
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help='wall time allowed to each paradigm, over all strategies, before '
+                             'they fall back to cheaper, marked results (default: no limit)')
+    parser.add_argument('--max-candidates', type=int, default=None,
+                        help='search states, candidate stems and index tuples allowed to each '
+                             'paradigm, over all strategies, before they fall back to cheaper, '
+                             'marked results (default: no limit)')
+    parser.add_argument('--segments', default=None,
+                        help='comma-separated segments written with several characters '
+                             '(e.g. aa,uu,th), each of which counts as one letter')
+    parser.add_argument('--segment-file', default=None,
+                        help='file of such segments, separated by whitespace or commas')
+    parser.add_argument('--encoding', default='utf-8',
+                        help='character encoding of the data files, used with segments '
+                             '(default: %(default)s)')
+    parser.add_argument('--metrics', action='store_true',
+                        help='write per-paradigm timings and counters of each data file '
+                             'to <output name>.metrics.jsonl')
+    args = parser.parse_args(argv)
+
+    fnameList = list()
+    for pattern in args.files:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            parser.error('no such data file: %s' % (pattern))
+        fnameList += [x for x in matches if x not in fnameList]
+
+    # output and log files are named after the data file, without its directory
+    fnamesByName = dict()
+    for fname in fnameList:
+        fnamesByName.setdefault(os.path.basename(fname), list()).append(fname)
+    for name in sorted(fnamesByName):
+        if len(fnamesByName[name]) > 1:
+            parser.error('data files with the same name would write the same output files: %s' %
+                         (' '.join(fnamesByName[name])))
+
+    # worker processes of a pool cannot have pools of their own
+    if args.jobs != 1 and args.processes != 1 and len(fnameList) > 1:
+        parser.error('-p/--processes cannot be used with -j/--jobs for several data files')
+
+    strategies = tuple([x.strip() for x in args.strategies.split(',') if x.strip()])
+    for strategy in strategies:
+        if strategy not in STRATEGY_NAMES:
+            parser.error('unknown strategy: %s' % (strategy))
+    outputFormats = tuple([x.strip() for x in args.formats.split(',') if x.strip()])
+    for outputFormat in outputFormats:
+        if outputFormat not in OUTPUT_WRITERS:
+            parser.error('unknown output format: %s' % (outputFormat))
+
+    segmentList = None
+    if args.segments is not None or args.segment_file is not None:
+        segmentList = list()
+        if args.segments:
+            segmentList += [x.strip() for x in args.segments.split(',') if x.strip()]
+        if args.segment_file:
+            segmentList += readSegments(args.segment_file)
+
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    if args.clear_cache:
+        ResultCache(args.cache_dir, args.cache_size * 1024 * 1024).clear()
+
+    jobList = list()
+    for fname in fnameList:
+        fname_bare = os.path.basename(fname)
+        kwargs = dict(width=args.width, height=args.height, processes=args.processes,
+                      useCache=not args.no_cache, cacheDir=args.cache_dir,
+                      cacheSize=args.cache_size * 1024 * 1024,
+                      memoRenaming=args.memo_renaming, outputFormats=outputFormats,
+                      compilePdf=not args.no_pdf, viewer=args.viewer,
+                      latexChunkSize=args.latex_chunk_size, strategies=strategies,
+                      outputDir=args.output_dir,
+                      maxSeconds=args.max_seconds, maxCandidates=args.max_candidates,
+                      segments=(SegmentInventory(segmentList, args.encoding)
+                                if segmentList is not None else None),
+                      logfilename='log-%s-%s.txt' % (fname_bare[:-4],
+                                   time.strftime("%Y-%m-%d-%H-%M-%S", time.localtime())))
+        if args.metrics:
+            kwargs['metricsFilename'] = os.path.join(args.output_dir, fname_bare[:-4] + '.metrics.jsonl')
+        jobList.append((fname, kwargs))
+
+    if args.jobs == 1 or len(jobList) == 1:
+        # the .pdf of each data file is compiled while the next one is processed
+        outcomes = (runFile(job, wait=False) for job in jobList)
+    else:
+        pool = multiprocessing.Pool(args.jobs)
+        outcomes = pool.imap_unordered(runFile, jobList)
+
+    failures = 0
+    compileThreadList = list()
+    for (fname, error, compileThread) in outcomes:
+        if error:
+            failures += 1
+            print 'FAILED %s (%s)' % (fname, error)
+        else:
+            print 'done   %s' % (fname)
+        if compileThread is not None:
+            compileThreadList.append(compileThread)
 
-    sys.stdout.close()
-    for command in commands:
-        subprocess.call((command, latexfilename[:-4]), stdout=open(logfilename, 'a'))
-    subprocess.call(('evince', latexfilename[:-4]+'.pdf'), stdout=open(logfilename, 'a'))
-    sys.stdout = open(logfilename, 'a')
+    for compileThread in compileThreadList:
+        compileThread.join()
 
-    print '\nOutput .pdf file produced!'
+    if args.jobs != 1 and len(jobList) > 1:
+        pool.close()
+        pool.join()
 
-    print
-    sys.stdout.close()
+    return 1 if failures else 0
 
 if __name__ == '__main__':
-    main()
+    sys.exit(commandLine())
 
@@ -12,6 +12,40 @@ from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 import stemExtract as SE
 
+class extractionWorker(QThread):
+    """runs SE.main in a background thread, reporting each paradigm done
+    with the signal paradigmDone(int, PyQt_PyObject) and the end of the run
+    with the signal done(bool), whose argument is True if it was cancelled;
+    if SE.main raises, the signal failed(QString) comes with the error first.
+    The .pdf is compiled (and shown) in a thread of its own, so that the run
+    is over as soon as the .tex file is written."""
+    def __init__(self, dataFile, outputFilename, width, height, parent=None):
+        super(extractionWorker, self).__init__(parent)
+        self.dataFile = dataFile
+        self.outputFilename = outputFilename
+        self.width = width
+        self.height = height
+        self.cancelFlag = False
+
+    def run(self):
+        try:
+            SE.main(self.dataFile, self.outputFilename, self.width, self.height,
+                    viewer=True, background=True,
+                    progress=self.reportProgress, cancelled=self.isCancelled)
+        except Exception as e:
+            self.emit(SIGNAL('failed(QString)'), '%s: %s' % (e.__class__.__name__, e))
+        finally:
+            self.emit(SIGNAL('done(bool)'), self.cancelFlag)
+
+    def reportProgress(self, rowNumber, leaf, stemsList):
+        self.emit(SIGNAL('paradigmDone(int, PyQt_PyObject)'), rowNumber, (leaf, stemsList))
+
+    def cancel(self):
+        self.cancelFlag = True
+
+    def isCancelled(self):
+        return self.cancelFlag
+
 class widgetFromFile(QWidget):
     def __init__(self, parent=None):
         super(widgetFromFile, self).__init__(parent)
@@ -22,8 +56,11 @@ class widgetFromFile(QWidget):
         self.dataFileLabel = self.noDataText
         self.headerDataFile = QLabel('')
         self.badFilenameChars = '#%&{}\\/<>*?$!`\'\":@+|= '
+        self.worker = None
+        self.errorMessage = None
+        self.nParadigms = 0
 
-        self.resize(400, 100)
+        self.resize(400, 300)
         self.setWindowTitle('StemExtract')
 
         #### output settings ####
@@ -65,8 +102,13 @@ class widgetFromFile(QWidget):
 
         #### bottom buttons ####
         # "Run" button
-        runButton = QPushButton('Run', self)
-        self.connect(runButton, SIGNAL('clicked()'), self.runSE)
+        self.runButton = QPushButton('Run', self)
+        self.connect(self.runButton, SIGNAL('clicked()'), self.runSE)
+
+        # "Cancel" button
+        self.cancelButton = QPushButton('Cancel', self)
+        self.cancelButton.setEnabled(False)
+        self.connect(self.cancelButton, SIGNAL('clicked()'), self.cancelSE)
 
         # "Read data" button
         readDataButton = QPushButton('Read data', self)
@@ -79,9 +121,17 @@ class widgetFromFile(QWidget):
         # buttons' layouts
         runButtonLayout = QHBoxLayout()
         runButtonLayout.addStretch(1)
-        runButtonLayout.addWidget(runButton)
+        runButtonLayout.addWidget(self.runButton)
+        runButtonLayout.addWidget(self.cancelButton)
         runButtonLayout.addStretch(1)
 
+        #### progress and results ####
+        self.progressBar = QProgressBar()
+        self.progressBar.setValue(0)
+        self.progressLabel = QLabel('')
+        self.resultsDisplay = QTextEdit()
+        self.resultsDisplay.setReadOnly(True)
+
         loadDataButtonLayout = QHBoxLayout()
         loadDataButtonLayout.addStretch(1)
         loadDataButtonLayout.addWidget(readDataButton)
@@ -104,17 +154,66 @@ class widgetFromFile(QWidget):
         overallLayout.addLayout(outputLayout)
         overallLayout.addWidget(QLabel('Step 3: <b>Click \"Run\"</b> '))
         overallLayout.addLayout(runButtonLayout)
+        overallLayout.addWidget(self.progressBar)
+        overallLayout.addWidget(self.progressLabel)
+        overallLayout.addWidget(self.resultsDisplay)
         overallLayout.addWidget(QLabel('<hr>'))
         self.setLayout(overallLayout)
 
     def runSE(self):
-        if self.dataFile and self.checkFilename:
-            SE.main(self.dataFile, self.outputFilename.text(),
-                    str(self.width.value()), str(self.height.value()))
+        if self.worker is not None:
+            return # already running
+        if self.dataFile and self.checkFilename():
+            # number of paradigms = number of lines in the data file
+            self.nParadigms = sum([1 for line in open(self.dataFile.name) if line.strip()])
+            self.progressBar.setRange(0, max(self.nParadigms, 1))
+            self.progressBar.setValue(0)
+            self.progressLabel.setText('Running...')
+            self.resultsDisplay.clear()
+
+            self.worker = extractionWorker(self.dataFile, self.outputFilename.text(),
+                                           str(self.width.value()), str(self.height.value()))
+            self.connect(self.worker, SIGNAL('paradigmDone(int, PyQt_PyObject)'), self.showParadigm)
+            self.connect(self.worker, SIGNAL('failed(QString)'), self.failSE)
+            self.connect(self.worker, SIGNAL('done(bool)'), self.finishSE)
+            self.runButton.setEnabled(False)
+            self.cancelButton.setEnabled(True)
+            self.worker.start()
         else:
             QMessageBox.warning(self, "No data",
                                       "Please specify a suitable .csv data file .")
 
+    def cancelSE(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.cancelButton.setEnabled(False)
+            self.progressLabel.setText('Cancelling...')
+
+    def showParadigm(self, rowNumber, result):
+        (leaf, stemsList) = result
+        self.progressBar.setValue(rowNumber + 1)
+        self.progressLabel.setText('Paradigms done: %d of %d' % (rowNumber + 1, self.nParadigms))
+        self.resultsDisplay.append('<b>%s</b> &nbsp; %s' %
+                                   (leaf, ' &nbsp; '.join(['%s: %s' % (strategy, ', '.join(stems))
+                                                           for (strategy, stems) in stemsList])))
+
+    def failSE(self, message):
+        self.errorMessage = message
+
+    def finishSE(self, cancelled):
+        self.worker.wait()
+        self.worker = None
+        self.runButton.setEnabled(True)
+        self.cancelButton.setEnabled(False)
+        if self.errorMessage is not None:
+            self.progressLabel.setText('Failed after %d paradigm(s)' % (self.progressBar.value()))
+            QMessageBox.warning(self, "Error", "Stem extraction failed:\n%s" % (self.errorMessage))
+            self.errorMessage = None
+        elif cancelled:
+            self.progressLabel.setText('Cancelled after %d paradigm(s)' % (self.progressBar.value()))
+        else:
+            self.progressLabel.setText('Done: %d paradigm(s)' % (self.progressBar.value()))
+
     def showOpenFileDialog(self):
         fname = QFileDialog.getOpenFileName(self, 'Open data file', '.', '*.csv')
         if fname:
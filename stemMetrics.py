@@ -0,0 +1,138 @@
+#!/usr/bin/python
+
+# per-paradigm instrumentation of stem extraction
+# Jackson Lee
+
+import json
+import logging
+
+#####################################################
+
+# A record is made for each paradigm when instrumentation is on:
+#
+#   {'row': row number, 'leaf': leaf, 'seconds': wall time for the paradigm,
+#    'constructionSeconds': wall time for building the stemplex (0 if not built),
+#    'strategies': {strategy: {'seconds': wall time,
+#                              'source': 'computed', 'memo' or 'cache',
+#                              'candidates': candidate stems (or search states) tried,
+#                              'abandonedCandidates': candidate stems tried before the
+#                                        substring strategy switched engines, if it did,
+#                              'combinations': index combinations enumerated,
+#                              'alignments': index tuples in the result,
+#                              'memoHits': 0 or 1, 'cacheHits': 0 or 1,
+#                              'budgetExceeded': 0 or 1,
+#                              'budget': what the strategy fell back to, only if
+#                                        it ran out of budget (see stemplex.Budget)}, ...}}
+#
+# and handed to every sink of a Metrics object with sink.emit(record).
+
+#####################################################
+
+###################
+## Class Metrics ##
+###################
+
+class Metrics(object):
+    '''Hands the record of each paradigm to all its sinks and keeps
+    running totals per strategy, and the slowest paradigm, for a summary.'''
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+        self.paradigms = 0
+        self.totals = dict() # strategy => {'seconds': ..., 'candidates': ..., ...}
+        self.slowest = None # record of the slowest paradigm so far
+
+    #class Metrics-------------------------------------------------------------#
+
+    def emit(self, record):
+        self.paradigms += 1
+        for (strategy, entry) in record['strategies'].items():
+            totals = self.totals.setdefault(strategy, dict())
+            for (key, value) in entry.items():
+                if key not in ('source', 'budget'):
+                    totals[key] = totals.get(key, 0) + value
+        if self.slowest is None or record['seconds'] > self.slowest['seconds']:
+            self.slowest = record
+        for sink in self.sinks:
+            sink.emit(record)
+
+    def summary(self):
+        'list of lines summing up all paradigms so far'
+        lines = ['Paradigms instrumented: %d' % (self.paradigms)]
+        for strategy in sorted(self.totals):
+            totals = self.totals[strategy]
+            lines.append('%s: %.4fs; ' % (strategy, totals.get('seconds', 0)) +
+                         ', '.join(['%s %d' % (key, totals[key])
+                                    for key in sorted(totals) if key != 'seconds']))
+        if self.slowest is not None:
+            lines.append('Slowest paradigm: row %d (%s), %.4fs' %
+                         (self.slowest['row'], self.slowest['leaf'], self.slowest['seconds']))
+        return lines
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+#####################################################
+
+#######################
+## Class LoggingSink ##
+#######################
+
+class LoggingSink(object):
+    'logs each record as one line of JSON'
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('stemExtract.metrics')
+        self.level = level
+
+    def emit(self, record):
+        self.logger.log(self.level, 'paradigm %s', json.dumps(record, sort_keys=True))
+
+    def close(self):
+        pass
+
+#####################################################
+
+########################
+## Class JsonFileSink ##
+########################
+
+class JsonFileSink(object):
+    'writes each record to a file as one line of JSON (JSON Lines)'
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'w')
+
+    def emit(self, record):
+        self.file.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def close(self):
+        self.file.close()
+
+#####################################################
+
+#########################
+## Class CollectorSink ##
+#########################
+
+class CollectorSink(object):
+    'keeps the records in memory, in the list self.records'
+
+    def __init__(self):
+        self.records = list()
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def slowest(self, n=10, strategy=None):
+        '''the n slowest records, overall or for one strategy'''
+        if strategy is None:
+            key = lambda record: record['seconds']
+        else:
+            key = lambda record: record['strategies'].get(strategy, {}).get('seconds', 0)
+        return sorted(self.records, key=key, reverse=True)[:n]
+
+    def close(self):
+        pass
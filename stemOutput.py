@@ -0,0 +1,494 @@
+#!/usr/bin/python
+
+# output writers for stem extraction results
+# Jackson Lee
+
+import os
+import sys
+import time
+import subprocess
+import threading
+import multiprocessing
+import json
+import struct
+import array
+
+#####################################################
+
+# Each writer takes the results of one paradigm at a time through
+# writeParadigm(rowNumber, leaf, sourceRow, strategyResults, notes), where
+# strategyResults is a list of (strategy, [(stem, indexTuplesMasterList), ...])
+# and indexTuplesMasterList holds, for each form of the paradigm, the index
+# tuples of the stem in that form; notes = {strategy: marker} for the strategies
+# that ran out of budget (see stemplex.Budget), or None. Nothing is kept once
+# it has been written.
+
+#####################################################
+
+###############
+## Functions ##
+###############
+
+#----------------------------------------------------------------#
+
+# how each letter of an improved source word is typeset: stem letters are
+# underlined, affix letters are coloured by where they are relative to the stem
+STEM_LETTER = '{\\bf\\underline{%s}}'
+PREFIX_LETTER = '{\\bf \\color{Red}%s}'         # before all stem letters
+INFIX_LETTER = '{\\bf \\color{OliveGreen}%s}'   # between stem letters
+SUFFIX_LETTER = '{\\bf \\color{Blue}%s}'        # after all stem letters
+AFFIX_LETTER = '{\\bf \\color{RedOrange}%s}'    # no stem letter at all
+
+def improvedSourceWord(sourceWord, bestIndexList):
+    '''to color-code the stem, prefix, infix, and suffix in the "improvedSourceWord":
+    in the surface word, the best stem characters are in black (underlined)
+
+    Whether an affix letter is a prefix, infix or suffix letter only depends
+    on the first and last stem indices, so one pass over the word will do.'''
+    if not bestIndexList:
+        return ''.join([AFFIX_LETTER % c for c in sourceWord])
+    stemIndexSet = set(bestIndexList)
+    first = min(stemIndexSet)
+    last = max(stemIndexSet)
+    parts = list()
+    for (k,c) in enumerate(sourceWord):
+        if k in stemIndexSet:
+            parts.append(STEM_LETTER % c)
+        elif k < first:
+            parts.append(PREFIX_LETTER % c)
+        elif k > last:
+            parts.append(SUFFIX_LETTER % c)
+        else:
+            parts.append(INFIX_LETTER % c)
+    return ''.join(parts)
+
+
+#----------------------------------------------------------------#
+
+def renderImprovedSourceWords(sourceRow, improvedDictItems, stemType, note=None):
+    '''the longtable rows of one strategy for one paradigm, as one string:
+    for each stem, the colour-coded word forms with each of their index tuples
+    (note = the strategy's marker, if it ran out of budget)'''
+    if note:
+        stemType = '%s {\\color{red}(%s)}' % (stemType, note)
+    parts = list()
+    for (k, (stem, indexTuplesMasterList)) in enumerate(improvedDictItems):
+
+        # print 'substring' (or not), then the stem
+        if k == 0:
+            parts.append('%s & \n%s & \n' % (stemType, stem))
+        else:
+            parts.append(' & \n%s & \n' % (stem))
+
+        # print improved word forms
+        cells = ['\\dboxbr{' +
+                 ' \\\\ '.join([improvedSourceWord(sourceRow[e],indexTuple)
+                                for indexTuple in indexTuplesList]) + '}'
+                 for (e, indexTuplesList) in enumerate(indexTuplesMasterList)]
+        parts.append(' & \n'.join(cells))
+        if cells:
+            parts.append(' \\\\ \n')
+        parts.append('\\midrule \n')
+    return ''.join(parts)
+
+def printLatexImprovedSourceWords(latexfile, sourceRow, improvedDictItems, stemType):
+    latexfile.write(renderImprovedSourceWords(sourceRow, improvedDictItems, stemType))
+
+#----------------------------------------------------------------#
+
+#####################################################
+
+#######################
+## Class LatexWriter ##
+#######################
+
+LATEX_BUFFER_SIZE = 1 << 20 # characters of LaTeX kept before they are written out
+
+class LatexWriter(object):
+    '''the LaTeX document with a longtable of colour-coded word forms per paradigm;
+    with chunkSize, the document is split into files of chunkSize paradigms each
+    (name-001.tex, name-002.tex, ...), each of which compiles on its own
+
+    Each paradigm is rendered into one string, and the strings are written
+    out LATEX_BUFFER_SIZE characters or so at a time.'''
+
+    extension = '.tex'
+
+    def __init__(self, filename, dataFilename, nColumns, width='8.5', height='11', chunkSize=None):
+        self.filename = filename
+        self.filenames = list()
+        self.dataFilename = dataFilename
+        self.nColumns = nColumns
+        self.width = width
+        self.height = height
+        self.chunkSize = chunkSize
+        self.nParadigms = 0 # in the current file
+        self.latexfile = None
+        self.buffer = list()
+        self.bufferLength = 0
+        self.newFile()
+
+    def newFile(self):
+        if self.chunkSize:
+            filename = '%s-%03d%s' % (self.filename[:-4], len(self.filenames) + 1, self.extension)
+        else:
+            filename = self.filename
+        self.filenames.append(filename)
+        self.nParadigms = 0
+        self.latexfile = open(filename, 'w')
+
+        if self.chunkSize:
+            dataFileLine = 'Data file: %s (part %d)\n\n' % (self.dataFilename, len(self.filenames))
+        else:
+            dataFileLine = 'Data file: %s\n\n' % self.dataFilename
+        self.write('\\documentclass{article}\n'
+                   '\\usepackage{longtable}\n'
+                   '\\usepackage[letterpaper, margin=.3in, '
+                   'paperwidth=%sin, paperheight=%sin]{geometry}\n'
+                   '\\usepackage[usenames,dvipsnames]{color}\n'
+                   '\\usepackage{booktabs}\n\n'
+                   '\\usepackage{dashbox}\n\n'
+                   '\\usepackage{minibox}\n\n'
+                   '\\newcommand{\\dboxbr}[1]{\\framebox{\\minibox{#1}}}\n'
+                   '\\setlength{\\parindent}{0pt}\n\n'
+                   '\\begin{document}\n\n'
+                   '\\footnotesize\n\n'
+                   'results from StemExtract\n\n'
+                   'program created by Jackson Lee and John Goldsmith\\\\ \n\n' %
+                   (self.width, self.height) +
+                   dataFileLine +
+                   time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()) + '\n\n')
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.bufferLength += len(text)
+        if self.bufferLength >= LATEX_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.latexfile.write(''.join(self.buffer))
+        self.buffer = list()
+        self.bufferLength = 0
+
+    def writeParadigm(self, rowNumber, leaf, sourceRow, strategyResults, notes=None):
+        notes = notes or dict()
+        if self.chunkSize and self.nParadigms >= self.chunkSize:
+            self.close()
+            self.newFile()
+
+        # paradigm's "leaf", then a longtable based on longest common substrings,
+        # largest common multisets and longest common subsequences
+        self.write('\\bf{' + leaf + '}\n\n' +
+                   '\\begin{longtable}[l]{l|c|%s}\n' % (' p{8em} ' * (self.nColumns)) +
+                   '\\toprule [3pt]\n' +
+                   ''.join([renderImprovedSourceWords(sourceRow, improvedDictItems, strategy,
+                                                      notes.get(strategy))
+                            for (strategy, improvedDictItems) in strategyResults]) +
+                   '\\bottomrule  [3pt] \\\\ [10pt] \n' +
+                   '\\end{longtable}\n\n')
+        self.nParadigms += 1
+
+    def close(self):
+        self.write('\\end{document}\n')
+        self.flush()
+        self.latexfile.close()
+
+#----------------------------------------------------------------#
+
+LATEX_COMMANDS = ['latex', 'latex', 'dvipdf']
+LATEX_JOBS = multiprocessing.cpu_count() # .tex files compiled at the same time
+PDF_VIEWER = 'evince'
+
+def runLatexCommands(texFilename):
+    '''runs LATEX_COMMANDS on a .tex file, in its directory; returns (their output,
+    None if they all succeeded, or else what went wrong)'''
+    (directory, basename) = os.path.split(os.path.abspath(texFilename))
+    outputList = list()
+    for command in LATEX_COMMANDS:
+        try:
+            # no input, so that latex stops on errors instead of waiting for the user
+            process = subprocess.Popen((command, basename[:-4]), stdin=open(os.devnull),
+                                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=directory)
+        except OSError:
+            return (''.join(outputList), 'command not found: %s' % (command))
+        outputList.append(process.communicate()[0])
+        if process.returncode != 0:
+            return (''.join(outputList), '%s exited with code %d' % (command, process.returncode))
+    return (''.join(outputList), None)
+
+def compileLatex(texFilenameList, logfilename, viewer=False):
+    '''compiles the .tex files into .pdf files, up to LATEX_JOBS of them at the
+    same time, and opens the .pdf files in PDF_VIEWER if viewer=True; the
+    output of the commands and the files that could not be compiled go to
+    logfilename; returns True if all .pdf files were produced'''
+    outcomes = dict()
+    pending = list(texFilenameList)
+
+    def compileNext():
+        while True:
+            try:
+                texFilename = pending.pop()
+            except IndexError:
+                return
+            outcomes[texFilename] = runLatexCommands(texFilename)
+
+    threadList = [threading.Thread(target=compileNext)
+                  for i in range(min(LATEX_JOBS, len(texFilenameList)))]
+    for thread in threadList:
+        thread.start()
+    for thread in threadList:
+        thread.join()
+
+    logfile = open(logfilename, 'a')
+    pdfFilenameList = list()
+    for texFilename in texFilenameList:
+        (output, failure) = outcomes[texFilename]
+        logfile.write(output)
+        if failure:
+            logfile.write('\nCould not compile %s: %s\n' % (texFilename, failure))
+        else:
+            pdfFilenameList.append(texFilename[:-4] + '.pdf')
+    if viewer:
+        for pdfFilename in pdfFilenameList:
+            try:
+                subprocess.call((PDF_VIEWER, pdfFilename), stdout=logfile)
+            except OSError:
+                logfile.write('\nCommand not found: %s\n' % (PDF_VIEWER))
+                break
+    if pdfFilenameList:
+        logfile.write('\nOutput .pdf file(s) produced: %s\n' % (' '.join(pdfFilenameList)))
+    logfile.close()
+    return len(pdfFilenameList) == len(texFilenameList)
+
+def startCompileLatex(texFilenameList, logfilename, viewer=False, background=False):
+    '''runs compileLatex, in a background thread if background=True,
+    in which case the thread is returned (join() it to wait for the .pdf files)'''
+    if not background:
+        compileLatex(texFilenameList, logfilename, viewer)
+        return None
+    thread = threading.Thread(target=compileLatex, args=(texFilenameList, logfilename, viewer))
+    thread.start()
+    return thread
+
+#####################################################
+
+###########################
+## Class JsonLinesWriter ##
+###########################
+
+class JsonLinesWriter(object):
+    '''one JSON object per line for each (paradigm, strategy, stem):
+    {"row": 0, "leaf": "...", "strategy": "substring", "stem": "...",
+     "indices": [[[i, j, ...], ...], ...]} (index tuples for each form),
+    with "budget": marker if the strategy ran out of budget'''
+
+    extension = '.jsonl'
+
+    def __init__(self, filename, dataFilename=None, nColumns=None):
+        self.filename = filename
+        self.outfile = open(filename, 'w')
+
+    def writeParadigm(self, rowNumber, leaf, sourceRow, strategyResults, notes=None):
+        notes = notes or dict()
+        lines = list()
+        for (strategy, improvedDictItems) in strategyResults:
+            for (stem, indexTuplesMasterList) in improvedDictItems:
+                entry = {'row': rowNumber, 'leaf': leaf, 'strategy': strategy, 'stem': stem,
+                         'indices': [list(x) for x in indexTuplesMasterList]}
+                if strategy in notes:
+                    entry['budget'] = notes[strategy]
+                lines.append(json.dumps(entry, sort_keys=True, separators=(',', ':')))
+        self.outfile.write('\n'.join(lines) + '\n')
+
+    def close(self):
+        self.outfile.close()
+
+#####################################################
+
+#####################
+## Class TsvWriter ##
+#####################
+
+class TsvWriter(object):
+    '''one tab-separated line for each (paradigm, strategy, stem):
+    row, leaf, strategy, stem, then one field per form with its index tuples,
+    tuples separated by "|" and indices by ","; if the strategy ran out of
+    budget, its marker follows it in brackets, e.g. "subsequence (truncated)"'''
+
+    extension = '.tsv'
+
+    def __init__(self, filename, dataFilename=None, nColumns=None):
+        self.filename = filename
+        self.outfile = open(filename, 'w')
+        header = ['row', 'leaf', 'strategy', 'stem']
+        if nColumns:
+            header += ['form%d' % (k+1) for k in range(nColumns)]
+        self.outfile.write('\t'.join(header) + '\n')
+
+    def writeParadigm(self, rowNumber, leaf, sourceRow, strategyResults, notes=None):
+        notes = notes or dict()
+        lines = list()
+        for (strategy, improvedDictItems) in strategyResults:
+            if strategy in notes:
+                label = '%s (%s)' % (strategy, notes[strategy])
+            else:
+                label = strategy
+            for (stem, indexTuplesMasterList) in improvedDictItems:
+                fields = [str(rowNumber), leaf, label, stem]
+                for indexTuplesList in indexTuplesMasterList:
+                    fields.append('|'.join([','.join(map(str, indexTuple))
+                                            for indexTuple in indexTuplesList]))
+                lines.append('\t'.join(fields))
+        self.outfile.write('\n'.join(lines) + '\n')
+
+    def close(self):
+        self.outfile.close()
+
+#####################################################
+
+##########################
+## Class ColumnarWriter ##
+##########################
+
+COLUMNAR_MAGIC = 'STMX'
+COLUMNAR_VERSION = 1
+COLUMNAR_BLOCK = 4096 # records per block
+COLUMNAR_STRATEGIES = ['substring', 'multiset', 'subsequence']
+
+class ColumnarWriter(object):
+    '''compact binary file, one record for each (paradigm, strategy, stem),
+    stored column by column in blocks of up to COLUMNAR_BLOCK records
+
+    File layout: "STMX", version (1 byte), byte order (1 byte, "<" or ">"),
+    then blocks. A block is a series of length-prefixed columns; each
+    length is a 4-byte unsigned int giving the number of items:
+        rows         uint32 per record
+        strategies   uint8 per record (index into COLUMNAR_STRATEGIES)
+        stemEnds     uint32 per record (end offsets into stemBytes)
+        stemBytes    UTF-8 bytes of all stems
+        formCounts   uint32 per record (number of forms)
+        tupleCounts  uint32 per form (number of index tuples)
+        tupleLengths uint32 per index tuple
+        indices      uint32 per index
+    Leaves are not stored; the row number identifies the paradigm.
+    Neither are the markers of strategies that ran out of budget.
+    readColumnar() reads the file back.'''
+
+    extension = '.stmx'
+
+    def __init__(self, filename, dataFilename=None, nColumns=None):
+        self.filename = filename
+        self.outfile = open(filename, 'wb')
+        self.outfile.write(COLUMNAR_MAGIC + struct.pack('<B', COLUMNAR_VERSION) +
+                           ('<' if sys.byteorder == 'little' else '>'))
+        self.newBlock()
+
+    def newBlock(self):
+        self.nRecords = 0
+        self.rows = array.array('I')
+        self.strategies = array.array('B')
+        self.stemEnds = array.array('I')
+        self.stemBytes = list()
+        self.stemLength = 0
+        self.formCounts = array.array('I')
+        self.tupleCounts = array.array('I')
+        self.tupleLengths = array.array('I')
+        self.indices = array.array('I')
+
+    def writeParadigm(self, rowNumber, leaf, sourceRow, strategyResults, notes=None):
+        for (strategy, improvedDictItems) in strategyResults:
+            for (stem, indexTuplesMasterList) in improvedDictItems:
+                self.rows.append(rowNumber)
+                self.strategies.append(COLUMNAR_STRATEGIES.index(strategy))
+                stemBytes = stem.encode('utf-8') if isinstance(stem, unicode) else stem
+                self.stemBytes.append(stemBytes)
+                self.stemLength += len(stemBytes)
+                self.stemEnds.append(self.stemLength)
+                nForms = 0
+                for indexTuplesList in indexTuplesMasterList:
+                    nTuples = 0
+                    for indexTuple in indexTuplesList:
+                        self.tupleLengths.append(len(indexTuple))
+                        self.indices.extend(indexTuple)
+                        nTuples += 1
+                    self.tupleCounts.append(nTuples)
+                    nForms += 1
+                self.formCounts.append(nForms)
+                self.nRecords += 1
+        if self.nRecords >= COLUMNAR_BLOCK:
+            self.flush()
+
+    def flush(self):
+        if not self.nRecords:
+            return
+        stemBytes = ''.join(self.stemBytes)
+        for column in [self.rows, self.strategies, self.stemEnds]:
+            self.outfile.write(struct.pack('<I', len(column)) + column.tostring())
+        self.outfile.write(struct.pack('<I', len(stemBytes)) + stemBytes)
+        for column in [self.formCounts, self.tupleCounts, self.tupleLengths, self.indices]:
+            self.outfile.write(struct.pack('<I', len(column)) + column.tostring())
+        self.newBlock()
+
+    def close(self):
+        self.flush()
+        self.outfile.close()
+
+#----------------------------------------------------------------#
+
+def readColumnar(filename):
+    '''reads a file written by ColumnarWriter and yields
+    (row, strategy, stem, [[index tuple, ...] for each form]) for each record'''
+    infile = open(filename, 'rb')
+    header = infile.read(len(COLUMNAR_MAGIC) + 2)
+    if header[:len(COLUMNAR_MAGIC)] != COLUMNAR_MAGIC:
+        raise ValueError('not a StemExtract columnar file: %s' % (filename))
+    swap = header[-1] != ('<' if sys.byteorder == 'little' else '>')
+
+    def readColumn(typecode):
+        lengthBytes = infile.read(4)
+        if not lengthBytes:
+            return None
+        (length,) = struct.unpack('<I', lengthBytes)
+        if typecode is None:
+            return infile.read(length)
+        column = array.array(typecode)
+        column.fromstring(infile.read(length * column.itemsize))
+        if swap:
+            column.byteswap()
+        return column
+
+    while True:
+        rows = readColumn('I')
+        if rows is None:
+            break
+        strategies = readColumn('B')
+        stemEnds = readColumn('I')
+        stemBytes = readColumn(None)
+        formCounts = readColumn('I')
+        tupleCounts = iter(readColumn('I'))
+        tupleLengths = iter(readColumn('I'))
+        indices = readColumn('I')
+
+        stemStart = 0
+        indexStart = 0
+        for k in range(len(rows)):
+            stem = stemBytes[stemStart: stemEnds[k]]
+            stemStart = stemEnds[k]
+            indexTuplesMasterList = list()
+            for f in range(formCounts[k]):
+                indexTuplesList = list()
+                for t in range(next(tupleCounts)):
+                    tupleLength = next(tupleLengths)
+                    indexTuplesList.append(tuple(indices[indexStart: indexStart + tupleLength]))
+                    indexStart += tupleLength
+                indexTuplesMasterList.append(indexTuplesList)
+            yield (rows[k], COLUMNAR_STRATEGIES[strategies[k]], stem, indexTuplesMasterList)
+    infile.close()
+
+#----------------------------------------------------------------#
+
+OUTPUT_WRITERS = {'latex': LatexWriter,
+                  'jsonl': JsonLinesWriter,
+                  'tsv': TsvWriter,
+                  'columnar': ColumnarWriter}
@@ -6,12 +6,17 @@
 
 import math
 import itertools
+import bisect
 import time
 import random
-#import numpy
 import codecs
 #import re
 
+try:
+    import numpy
+except ImportError: # numpy is optional; without it, cost matrices are lists of lists
+    numpy = None
+
 #####################################################
 
 # Cost parameters
@@ -44,6 +49,16 @@ AFFIX_DIFF = 5
 
 LAMBDA_BITS = 5 # lambda
 
+# weights of the five rows of a cost matrix
+COST_WEIGHTS = [STEM_USED, STEM_NOT_USED, AFFIX_USED, AFFIX_NOT_USED, EXTRA]
+
+#####################################################
+
+# version of the stem extraction engines;
+# to be changed whenever what they return changes (results cached on disk are keyed by it)
+
+ENGINE_VERSION = '2'
+
 #####################################################
 
 ###############
@@ -109,45 +124,147 @@ def reorder(s, sample):
 
 def union(s):
     'takes a list of strings and returns its union'
-    temp = unorder(''.join(s))
-    letters = list(set(sorted([x for x in temp])))
-    result = ''
-    for l in letters:
-        c = 0
-        for word in s:
-            if word.count(l) > c:
-                c = word.count(l)
-        result += l*c
+    return multisetString(multisetUnion([countVector(w) for w in s]))
+
+#----------------------------------------------------------------#
+
+# multiset kernel
+# a multiset of letters is represented by its count vector,
+# a dict {letter: number of occurrences} with no zero counts
+
+def countVector(s):
+    'takes a string and returns its count vector'
+    counts = dict()
+    for l in s:
+        counts[l] = counts.get(l, 0) + 1
+    return counts
+
+def multisetString(counts):
+    'takes a count vector and returns the alphabetized string it represents'
+    return ''.join([l * counts[l] for l in sorted(counts)])
+
+def multisetIntersection(countList):
+    'takes a list of count vectors and returns their intersection (per-letter minimum)'
+    result = dict()
+    for l in countList[0]:
+        c = min([counts.get(l, 0) for counts in countList])
+        if c:
+            result[l] = c
+    return result
+
+def multisetUnion(countList):
+    'takes a list of count vectors and returns their union (per-letter maximum)'
+    result = dict()
+    for counts in countList:
+        for (l, c) in counts.iteritems():
+            if c > result.get(l, 0):
+                result[l] = c
+    return result
+
+def multisetResidue(counts, stemCounts):
+    'takes two count vectors and returns what is left of counts once stemCounts is removed'
+    return dict([(l, c - stemCounts.get(l, 0)) for (l, c) in counts.iteritems()
+                 if c > stemCounts.get(l, 0)])
+
+#----------------------------------------------------------------#
+
+def cost(stem,affix,target):
+    '''calculates the cost of a (stem, affix, target) trio
+    and returns the 5-dimensional cost vector'''
+
+    stemUsed = 0 # count of stem letters used
+    stemNotUsed = 0  # count of stem letters not used
+    affixUsed = 0  # count of affix letters used
+    affixNotUsed = 0  # count of affix letters not used
+    extra = 0  # count of extra letters needed
+
+    # target letters are matched against the stem first and then the affix
+    stemCounts = countVector(stem)
+    affixCounts = countVector(affix)
+    for (l, c) in countVector(target).iteritems():
+        lStemUsed = min(c, stemCounts.get(l, 0))
+        lAffixUsed = min(c - lStemUsed, affixCounts.get(l, 0))
+        stemUsed += lStemUsed
+        affixUsed += lAffixUsed
+        extra += c - lStemUsed - lAffixUsed
+    stemNotUsed = len(stem) - stemUsed
+    affixNotUsed = len(affix) - affixUsed
+
+    return [STEM_USED*stemUsed, STEM_NOT_USED*stemNotUsed,
+            AFFIX_USED*affixUsed, AFFIX_NOT_USED*affixNotUsed, EXTRA*extra]
+
+#----------------------------------------------------------------#
+
+# vectorized cost matrices (numpy)
+# words are encoded as count arrays over a common alphabet, letters on the last axis
+
+def letterIndexOf(words):
+    'takes a list of words and returns a dict {letter: column} over all their letters'
+    return dict([(l, i) for (i, l) in enumerate(sorted(set(''.join(words))))])
+
+def countArray(words, letterIndex):
+    '''takes a list of words and a dict {letter: column} and returns
+    the array of their count vectors, of shape (len(words), len(letterIndex))'''
+    result = numpy.zeros((len(words), len(letterIndex)), dtype=int)
+    for (i, word) in enumerate(words):
+        for l in word:
+            result[i, letterIndex[l]] += 1
     return result
 
+def costArrays(stemCounts, affixCounts, targetCounts):
+    '''takes count arrays of shape (..., stems, letters), (..., columns, letters)
+    and (..., stems, columns, letters) and returns the cost matrices of shape
+    (..., stems, 5, columns); the same as cost() for each (stem, affix, target)
+
+    Target letters are matched against the stem first and then the affix,
+    so with per-letter minima:
+        stem letters used = min(target, stem)
+        affix letters used = min(target - stem letters used, affix)
+        extra letters = target - stem letters used - affix letters used'''
+    stemCounts = stemCounts[..., :, numpy.newaxis, :]
+    affixCounts = affixCounts[..., numpy.newaxis, :, :]
+    stemUsed = numpy.minimum(targetCounts, stemCounts)
+    rest = targetCounts - stemUsed
+    affixUsed = numpy.minimum(rest, affixCounts)
+
+    stemUsedSum = stemUsed.sum(axis=-1)
+    affixUsedSum = affixUsed.sum(axis=-1)
+    matrices = numpy.array([stemUsedSum,
+                            stemCounts.sum(axis=-1) - stemUsedSum,
+                            affixUsedSum,
+                            affixCounts.sum(axis=-1) - affixUsedSum,
+                            (rest - affixUsed).sum(axis=-1)])
+    # (5, ..., stems, columns) => (..., stems, 5, columns), weighted
+    matrices = numpy.rollaxis(matrices, 0, matrices.ndim - 1)
+    return matrices * numpy.array(COST_WEIGHTS)[:, numpy.newaxis]
+
+def costMatrices(stemList, affixList, targetsList):
+    '''returns the cost matrices (5 x columns) of each stem of stemList,
+    given the affixes of all columns and the targets of each stem,
+    as numpy arrays (or as lists of lists without numpy)'''
+    if numpy is None:
+        return [[list(x) for x in zip(*[cost(stem, affix, target)
+                                         for (affix, target) in zip(affixList, targets)])]
+                for (stem, targets) in zip(stemList, targetsList)]
+    letterIndex = letterIndexOf(stemList + affixList + [''.join(x) for x in targetsList])
+    matrices = costArrays(countArray(stemList, letterIndex),
+                          countArray(affixList, letterIndex),
+                          numpy.array([countArray(x, letterIndex) for x in targetsList]).reshape(
+                              len(stemList), len(affixList), len(letterIndex)))
+    return list(matrices)
+
+def matrixSum(matrix):
+    'sum of all the cells of a cost matrix'
+    if numpy is not None:
+        return int(matrix.sum())
+    return sum([sum(line) for line in matrix])
+
 #----------------------------------------------------------------#
 
-#def cost(stem,affix,target):
-#    '''calculates the cost of a (stem, affix, target) trio
-#    and returns the 5-dimensional cost vector'''
-
-#    stemUsed = 0 # count of stem letters used
-#    stemNotUsed = 0  # count of stem letters not used
-#    affixUsed = 0  # count of affix letters used
-#    affixNotUsed = 0  # count of affix letters not used
-#    extra = 0  # count of extra letters needed
-#    tempStem = str(stem)
-#    tempAffix = str(affix)
-
-#    for l in target:
-#        if l in tempStem:
-#            stemUsed += 1
-#            tempStem = tempStem.replace(l,'',1)
-#        elif l in tempAffix:
-#            affixUsed += 1
-#            tempAffix = tempAffix.replace(l,'',1)
-#        else:
-#            extra += 1
-#    stemNotUsed = len(stem) - stemUsed
-#    affixNotUsed = len(affix) - affixUsed
-
-#    return numpy.array([STEM_USED*stemUsed, STEM_NOT_USED*stemNotUsed,
-#             AFFIX_USED*affixUsed, AFFIX_NOT_USED*affixNotUsed, EXTRA*extra])
+def addCount(counters, key, n):
+    'adds n to counters[key] if counters is a dict (i.e. instrumentation is on)'
+    if counters is not None:
+        counters[key] = counters.get(key, 0) + n
 
 #----------------------------------------------------------------#
 
@@ -162,7 +279,8 @@ def shortest(L):
 
 def createUnionAffixes(affixLists):
     'takes a list of lists of affixes, and returns the list of union affixes'
-    return [unorder(union(x)) for x in zip(*affixLists)]
+    return [multisetString(multisetUnion([countVector(w) for w in x]))
+            for x in zip(*affixLists)]
 #    return map(lambda x,y: unorder(union([x,y])), group1, group2)
 
 
@@ -179,75 +297,728 @@ def sublist(L, indices):
 def locateByIndex(string, substring):
     '''locate substring in string by indices of string'''
     resultIndexList = list()
-    i = 0
-    while i < len(string):
+    i = string.find(substring)
+    while i != -1:
+        resultIndexList.append(i)
+        i = string.find(substring, i + 1)
+    return resultIndexList
+
+def charPositions(word):
+    'takes a word and returns the dict {letter: sorted list of its positions in word}'
+    positions = dict()
+    for (i, l) in enumerate(word):
+        if l in positions:
+            positions[l].append(i)
+        else:
+            positions[l] = [i]
+    return positions
+
+#----------------------------------------------------------------#
+
+def depthFirstTuples(depth, choices):
+    '''generate, depth first, the tuples (c0, c1, ..., c[depth-1]) where each
+    c[k] is taken in turn from choices(k, [c0, ..., c[k-1]]); an explicit stack
+    of iterators is used instead of recursion, so that depth is not limited
+    by the recursion limit'''
+    if depth == 0:
+        yield tuple()
+        return
+    prefix = list()
+    stack = [iter(choices(0, prefix))]
+    while stack:
         try:
-            startIndex = string[i:].index(substring)
-        except ValueError:
+            c = next(stack[-1])
+        except StopIteration:
+            stack.pop()
+            if prefix:
+                prefix.pop()
+            continue
+        if len(stack) == depth:
+            yield tuple(prefix) + (c,)
+        else:
+            prefix.append(c)
+            stack.append(iter(choices(len(stack), prefix)))
+
+#----------------------------------------------------------------#
+
+def enumerateCommonSubsequences(shortWord, wordList, counters=None, budget=None):
+    '''find all longest common subsequences of the words in wordList
+    by trying every subsequence of shortWord, from the longest down
+    (reference mode: exponential in the length of shortWord);
+    counters = dict for the numbers of candidates and combinations tried, or None;
+    budget = a Budget to spend one candidate of per candidate stem, or None'''
+    goodStemList = list()
+    longestLength = 0
+    nCandidates = 0
+    nCombinations = 0
+
+    for k in range(len(shortWord), -1, -1): # k = length of stem
+        if k <= longestLength:
             break
-        resultIndexList.append(startIndex + i)
-        i = startIndex + i + 1
-    return list(resultIndexList)
+
+        possibleStemList = list(itertools.combinations(shortWord, k))
+
+        nCombinations += len(possibleStemList)
+        for possibleStem in possibleStemList: # type(possibleStem) = tuple
+            nCandidates += 1
+            if budget is not None:
+                budget.spend()
+            for sourceWord in wordList:
+                NChooseKCombos = list(itertools.combinations(sourceWord, k))
+                nCombinations += len(NChooseKCombos)
+                if possibleStem not in NChooseKCombos:
+                    break
+            else:
+                goodStemList.append(''.join(possibleStem))
+                if not longestLength:
+                    longestLength = len(possibleStem)
+
+    addCount(counters, 'candidates', nCandidates)
+    addCount(counters, 'combinations', nCombinations)
+    return goodStemList
+
+#----------------------------------------------------------------#
+
+def longestCommonSubsequences(wordList, counters=None, budget=None):
+    '''find all longest common subsequences of the words in wordList
+    by dynamic programming over the next-occurrence tables of the words
+
+    A state is the tuple of positions (one per word) reached by embedding
+    a common subsequence greedily, i.e. each letter is matched at its
+    earliest possible position, so that every common subsequence has
+    exactly one path of states. The reachable states are solved bottom-up
+    with an explicit stack, each once, keeping for each the length of the
+    longest common subsequences from it and the letters they can start
+    with; the running time is bounded by the number of reachable states
+    rather than by the number of subsequences of the shortest word. The
+    number of states solved is added to counters['candidates'] if counters
+    is a dict, and one candidate of budget (a Budget, or None) is spent
+    per state.
+
+    Returns a generator of the longest common subsequences in sorted
+    order, each made as it is asked for by following the letters kept.'''
+
+    # nextTableList[w][i][c] = smallest j >= i with wordList[w][j] == c
+    nextTableList = list()
+    for word in wordList:
+        nextTable = [None] * (len(word) + 1)
+        nextTable[len(word)] = dict()
+        for i in range(len(word) - 1, -1, -1):
+            nextTable[i] = dict(nextTable[i + 1])
+            nextTable[i][word[i]] = i
+        nextTableList.append(nextTable)
+
+    def nextStates(state):
+        'list of (letter, next state) for the letters still available in every word from state'
+        commonLetters = set(nextTableList[0][state[0]])
+        for (nextTable, i) in zip(nextTableList[1:], state[1:]):
+            commonLetters.intersection_update(nextTable[i])
+        return [(c, tuple([nextTable[i][c] + 1 for (nextTable, i) in zip(nextTableList, state)]))
+                for c in commonLetters]
+
+    # state => (length of the LCS from state, sorted letters the LCS from state start with)
+    table = dict()
+
+    if not wordList:
+        return iter([])
+    startState = tuple([0] * len(wordList))
+    stack = [startState]
+    while stack:
+        state = stack[-1]
+        if state in table:
+            stack.pop()
+            continue
+        transitionList = nextStates(state)
+        pendingList = [nextState for (c, nextState) in transitionList if nextState not in table]
+        if pendingList:
+            stack.extend(pendingList)
+            continue
+        stack.pop()
+        if budget is not None:
+            budget.spend()
+        bestLength = 0
+        bestLetters = list()
+        for (c, nextState) in transitionList:
+            length = table[nextState][0] + 1
+            if length > bestLength:
+                bestLength = length
+                bestLetters = [c]
+            elif length == bestLength:
+                bestLetters.append(c)
+        table[state] = (bestLength, sorted(bestLetters))
+
+    addCount(counters, 'candidates', len(table))
+
+    def generateStems():
+        if not table[startState][0]:
+            return
+        # depth first from the start state along the letters kept, smallest letter first;
+        # a prefix is (its last letter, the prefix before it), down to None
+        stack = [(startState, None)]
+        while stack:
+            (state, prefix) = stack.pop()
+            letters = table[state][1]
+            if not letters:
+                stem = list()
+                while prefix is not None:
+                    stem.append(prefix[0])
+                    prefix = prefix[1]
+                stem.reverse()
+                yield ''.join(stem)
+                continue
+            transitionDict = dict(nextStates(state))
+            for c in reversed(letters):
+                stack.append((transitionDict[c], (c, prefix)))
+
+    return generateStems()
+
+#----------------------------------------------------------------#
+
+def multisetAlignments(word, stem, positions=None):
+    '''generate the index tuples at which the letters of the multiset stem
+    can be found in word (positions = charPositions(word), if already known)
+
+    For each stem letter occurring n times in stem, any n of its positions
+    in word may be chosen; the index tuples are the cartesian product of
+    these choices over all stem letters (letters taken in alphabetical
+    order), each tuple sorted. The choices are generated as the product is
+    walked, so nothing but the current tuple is held in memory.'''
+    if positions is None:
+        positions = charPositions(word)
+    stemCounts = countVector(stem)
+    stemChars = sorted(stemCounts)
+
+    def choices(k, previousChoices):
+        return itertools.combinations(positions.get(stemChars[k], []), stemCounts[stemChars[k]])
+
+    for stemIndicesTuple in depthFirstTuples(len(stemChars), choices):
+        yield tuple(sorted(itertools.chain(*stemIndicesTuple)))
+
+def countMultisetAlignments(word, stem, wordCounts=None):
+    '''number of index tuples multisetAlignments(word, stem) would generate
+    (wordCounts = countVector(word), if already known)'''
+    stemCounts = countVector(stem)
+    if wordCounts is None:
+        wordCounts = countVector(word)
+    result = 1
+    for stemChar in stemCounts:
+        if wordCounts.get(stemChar, 0) < stemCounts[stemChar]:
+            return 0
+        result *= choose(wordCounts[stemChar], stemCounts[stemChar])
+    return result
+
+#----------------------------------------------------------------#
+
+# how much enumerating candidate substrings may do before 'auto' switches to the
+# automaton (see Stemplex.extractStemSubstring): letters scanned per letter of the row,
+# and letters counted for the overhead of each check of a candidate against a word
+SUBSTRING_WORK_FACTOR = 1000
+SUBSTRING_CHECK_COST = 200
+
+def longestCommonSubstrings(wordList, counters=None):
+    '''find all longest common substrings of the words in wordList together
+    with their start positions in each word, using a generalized suffix
+    automaton built over all the words
+
+    Returns a dict {substring: [[start positions in word 0], ...]}.
+    The number of automaton states is added to counters['candidates']
+    if counters is a dict.'''
+    if not wordList:
+        return dict()
+
+    # suffix automaton states, as parallel lists
+    lengthList = [0]      # length of the longest string of the state
+    linkList = [-1]       # suffix link
+    nextList = [dict()]   # transitions
+    endList = [list()]    # (word index, end position) of prefixes ending here
+
+    def newState(length, link, transitions):
+        lengthList.append(length)
+        linkList.append(link)
+        nextList.append(transitions)
+        endList.append(list())
+        return len(lengthList) - 1
+
+    def split(p, c, q):
+        # clone q so that the state reached from p by c has length lengthList[p]+1
+        clone = newState(lengthList[p] + 1, linkList[q], dict(nextList[q]))
+        linkList[q] = clone
+        while p != -1 and nextList[p].get(c) == q:
+            nextList[p][c] = clone
+            p = linkList[p]
+        return clone
+
+    def extend(last, c):
+        if c in nextList[last]:
+            q = nextList[last][c]
+            if lengthList[q] == lengthList[last] + 1:
+                return q
+            return split(last, c, q)
+
+        current = newState(lengthList[last] + 1, 0, dict())
+        p = last
+        while p != -1 and c not in nextList[p]:
+            nextList[p][c] = current
+            p = linkList[p]
+        if p != -1:
+            q = nextList[p][c]
+            if lengthList[q] == lengthList[p] + 1:
+                linkList[current] = q
+            else:
+                linkList[current] = split(p, c, q)
+        return current
+
+    for (w, word) in enumerate(wordList):
+        last = 0
+        for (i, c) in enumerate(word):
+            last = extend(last, c)
+            endList[last].append((w, i))
+
+    # which words each state occurs in (bitmask), propagated up suffix links
+    maskList = [0] * len(lengthList)
+    for state in range(len(lengthList)):
+        for (w, i) in endList[state]:
+            maskList[state] |= 1 << w
+    stateOrder = sorted(range(len(lengthList)), key=lambda x: lengthList[x], reverse=True)
+    for state in stateOrder:
+        if linkList[state] > 0:
+            maskList[linkList[state]] |= maskList[state]
+
+    addCount(counters, 'candidates', len(lengthList))
+    fullMask = (1 << len(wordList)) - 1
+    longestLength = max([0] + [lengthList[x] for x in range(len(lengthList))
+                               if maskList[x] == fullMask])
+    if not longestLength:
+        return dict()
+
+    # each longest common substring is the longest string of exactly one state;
+    # these states are not suffix-link ancestors of one another, so collecting
+    # the end positions of their subtrees visits every state at most once
+    childrenList = [list() for x in lengthList]
+    for state in range(1, len(lengthList)):
+        childrenList[linkList[state]].append(state)
+
+    resultDict = dict()
+    for state in range(1, len(lengthList)):
+        if maskList[state] != fullMask or lengthList[state] != longestLength:
+            continue
+        positionsList = [list() for x in wordList]
+        stack = [state]
+        while stack:
+            descendant = stack.pop()
+            for (w, i) in endList[descendant]:
+                positionsList[w].append(i - longestLength + 1)
+            stack.extend(childrenList[descendant])
+        positionsList = [sorted(x) for x in positionsList]
+        start = positionsList[0][0]
+        resultDict[wordList[0][start: start + longestLength]] = positionsList
+    return resultDict
+
+#----------------------------------------------------------------#
+
+def subsequenceAlignments(word, stem, cap=None, positions=None):
+    '''generate the strictly increasing index tuples at which stem occurs
+    as a subsequence of word, in lexicographic order, and stop after "cap"
+    tuples if cap is given (positions = charPositions(word), if already known)
+
+    For each stem letter, only positions from which the rest of the stem
+    can still be completed are tried, so every partial tuple extended
+    leads to at least one yielded tuple.'''
+    if positions is None:
+        positions = charPositions(word)
+    positionList = [positions.get(stemChar, []) for stemChar in stem]
+
+    # latestList[j] = the last position at which stem[j] can be placed
+    #                 with stem[j+1:] still fitting after it
+    latestList = [0] * len(stem)
+    limit = len(word)
+    for j in range(len(stem) - 1, -1, -1):
+        feasible = [p for p in positionList[j] if p < limit]
+        if not feasible:
+            return
+        latestList[j] = limit = feasible[-1]
+
+    def choices(j, indexList):
+        previous = indexList[-1] if indexList else -1
+        return positionList[j][bisect.bisect_right(positionList[j], previous):
+                               bisect.bisect_right(positionList[j], latestList[j])]
+
+    alignments = depthFirstTuples(len(stem), choices)
+    if cap is not None:
+        alignments = itertools.islice(alignments, cap)
+    for indexTuple in alignments:
+        yield indexTuple
+
+#----------------------------------------------------------------#
+
+#####################################################
+
+############################
+## Class SegmentInventory ##
+############################
+
+SYMBOL_BASE = 0xE000 # symbols are code points of the Unicode private use area,
+MAX_SYMBOLS = 0x1900 # U+E000 to U+F8FF
+
+class SegmentInventory(object):
+    '''Turns word forms into sequences of segment symbols, so that segments
+    written with several characters (phonemes such as "aa" or "th", letters
+    with combining diacritics, UTF-8 encoded characters) count as one letter
+    in every strategy and in the multiset kernel.
+
+    The forms of a row (or of several rows, which then share their symbols)
+    are encoded together: their distinct segments, sorted, are numbered from
+    0 in a table, and a form is encoded as the unicode string whose code
+    points are SYMBOL_BASE + the numbers of its segments. This is an array of
+    integer symbols on which the strategies' string operations (comparison,
+    hashing, find, slicing) work unchanged, with stems made of symbols and
+    index tuples counting segments. As symbols are in the order of their
+    segments and depend on nothing but the rows encoded, the results on a
+    row do not depend on the rows before it, and multiset stems list their
+    segments in sorted order.
+
+    "segments" are the multi-character segments; the forms are decoded with
+    "encoding" and cut into segments from left to right, taking the longest
+    segment of the inventory that matches, or else a single character.'''
+
+    def __init__(self, segments=(), encoding='utf-8'):
+        self.encoding = encoding
+        self.multiSegments = dict() # first character => segments of the inventory, longest first
+        for segment in segments:
+            segment = self.decodeBytes(segment)
+            if len(segment) > 1:
+                self.multiSegments.setdefault(segment[0], list()).append(segment)
+        for segmentList in self.multiSegments.values():
+            segmentList.sort(key=len, reverse=True)
+
+    def decodeBytes(self, word):
+        if isinstance(word, unicode):
+            return word
+        return word.decode(self.encoding)
+
+    def tokenize(self, word):
+        'the list of the segments of a word (unicode)'
+        word = self.decodeBytes(word)
+        segmentList = list()
+        i = 0
+        while i < len(word):
+            for segment in self.multiSegments.get(word[i], ()):
+                if word.startswith(segment, i):
+                    break
+            else:
+                segment = word[i]
+            segmentList.append(segment)
+            i += len(segment)
+        return segmentList
+
+    def encodeRows(self, rows):
+        '''returns (the data rows with their forms (not the leaves) encoded,
+        the table of their segments (as in the data) by symbol number)'''
+        tokenizedRows = [[self.tokenize(x) for x in row[1:]] for row in rows]
+        segmentList = sorted(set([segment for tokenizedRow in tokenizedRows
+                                  for tokenizedForm in tokenizedRow for segment in tokenizedForm]))
+        if len(segmentList) > MAX_SYMBOLS:
+            raise ValueError('more than %d distinct segments' % (MAX_SYMBOLS))
+        symbols = dict([(segment, unichr(SYMBOL_BASE + i)) for (i, segment) in enumerate(segmentList)])
+        encodedRows = [row[:1] + [u''.join([symbols[segment] for segment in tokenizedForm])
+                                  for tokenizedForm in tokenizedRow]
+                       for (row, tokenizedRow) in zip(rows, tokenizedRows)]
+        return (encodedRows, tuple([segment.encode(self.encoding) for segment in segmentList]))
+
+    def encodeRow(self, row):
+        '''returns (the data row with its forms (not the leaf) encoded,
+        the table of its segments by symbol number)'''
+        (encodedRows, table) = self.encodeRows([row])
+        return (encodedRows[0], table)
+
+    def segments(self, symbols, table):
+        'the tuple of the segments (as in the data) of a symbol string'
+        return tuple([table[ord(x) - SYMBOL_BASE] for x in symbols])
+
+    def decode(self, symbols, table):
+        'the word form (as in the data) of a symbol string'
+        return ''.join(self.segments(symbols, table))
+
+#----------------------------------------------------------------#
+
+def readSegments(filename):
+    'reads a segment inventory file: segments separated by whitespace or commas'
+    return open(filename).read().replace(',', ' ').split()
+
+#####################################################
+
+##################
+## Class Budget ##
+##################
+
+class BudgetExceeded(Exception):
+    'raised by Budget.spend() once a budget is used up'
+
+class Budget(object):
+    '''A limit on the work done on one paradigm, shared by its strategies in
+    turn: at most "seconds" of wall time from when the budget is made, and at
+    most "candidates" candidates (search states, candidate stems or index
+    tuples) enumerated; None = no limit. The strategies call spend() for each
+    candidate and, when it raises BudgetExceeded, fall back to something
+    cheaper and say what in self.marker (None while the budget holds), which
+    is reset to None before the next strategy.'''
+    __slots__ = ('maxCandidates', 'deadline', 'candidates', 'marker')
+
+    def __init__(self, seconds=None, candidates=None):
+        self.maxCandidates = candidates
+        self.deadline = None if seconds is None else time.time() + seconds
+        self.candidates = 0
+        self.marker = None
+
+    def spend(self, n=1):
+        self.candidates += n
+        if self.maxCandidates is not None and self.candidates > self.maxCandidates:
+            raise BudgetExceeded('more than %d candidates' % (self.maxCandidates))
+        if self.deadline is not None and time.time() > self.deadline:
+            raise BudgetExceeded('out of time')
+
+# what Budget.marker says when a strategy has run out of budget
+TRUNCATED = 'truncated'
+FALLBACK_SUBSTRING = 'fallback: substring'
+
+def takeAlignments(alignmentsList, budget):
+    '''takes the index tuple generators of the words of a paradigm and returns
+    their lists of index tuples, spending one candidate of budget per tuple;
+    once the budget is used up (budget.marker = TRUNCATED), each word keeps
+    what it already has, or else only its first index tuple'''
+    resultList = list()
+    for alignments in alignmentsList:
+        indexTuples = list()
+        if budget.marker is None:
+            try:
+                for indexTuple in alignments:
+                    indexTuples.append(indexTuple)
+                    budget.spend()
+            except BudgetExceeded:
+                budget.marker = TRUNCATED
+        if budget.marker is not None and not indexTuples:
+            indexTuples = list(itertools.islice(alignments, 1))
+        resultList.append(indexTuples)
+    return resultList
+
+#####################################################
+
+####################
+## Class RowIndex ##
+####################
+
+class RowIndex(object):
+    '''What all three stem extraction strategies need to know about the
+    word forms of one paradigm, computed once: for each form, its count
+    vector and the positions of each of its letters (see charPositions).
+    It is not kept by the Stemplex: the caller
+    makes one with Stemplex.rowIndex(), hands it to each strategy and drops
+    it once the paradigm is done.'''
+    __slots__ = ('MyWordList', 'MyCountsList', 'MyPositionsList')
+
+    def __init__(self, wordList):
+        self.MyWordList = wordList
+        self.MyCountsList = [countVector(x) for x in wordList]
+        self.MyPositionsList = [charPositions(x) for x in wordList]
+
+    def words(self):
+        return self.MyWordList
+
+    def counts(self):
+        return self.MyCountsList
+
+    def positions(self):
+        return self.MyPositionsList
+
+#####################################################
+
+####################
+## Class TreeNode ##
+####################
+
+class TreeNode(object):
+    '''A node of the merge tree of a stemplex: either a leaf (one paradigm)
+    or the merge of two subtrees, with its merge number (MyIndex, 0 for a
+    leaf) and the cost saved by the merge. MyMother is None for the root.'''
+    __slots__ = ('MyIndex', 'MyLeaf', 'MyLeftDaughter', 'MyRightDaughter', 'MyMother', 'MyCostSaved')
+
+    def __init__(self, leaf=None, index=0, leftDaughter=None, rightDaughter=None, costSaved=None):
+        self.MyIndex = index
+        self.MyLeaf = leaf
+        self.MyLeftDaughter = leftDaughter
+        self.MyRightDaughter = rightDaughter
+        self.MyMother = None
+        self.MyCostSaved = costSaved
+        for daughter in (leftDaughter, rightDaughter):
+            if daughter is not None:
+                daughter.MyMother = self
+
+    def isLeaf(self):
+        return self.MyLeftDaughter is None
+
+    def nodes(self):
+        'all nodes of the subtree, each mother before its daughters, left before right'
+        result = list()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            result.append(node)
+            if not node.isLeaf():
+                stack.append(node.MyRightDaughter)
+                stack.append(node.MyLeftDaughter)
+        return result
+
+    def leaves(self):
+        'the leaves of the subtree, from left to right'
+        return [node.MyLeaf for node in self.nodes() if node.isLeaf()]
 
 #----------------------------------------------------------------#
 
+def collapsibleNodes(root):
+    '''returns the set of the nodes of the tree under which the paradigms are
+    morphologically identical, so that they can be shown as one table:
+    starting from a node whose two daughters are leaves, which is the right
+    daughter of its mother and whose sister is a leaf, the highest ancestor
+    reached by going up as long as the mother has saved the same cost and
+    has a leaf as left daughter
+
+          mother
+           /  \
+        leaf  *NODE*
+               /  \
+             leaf  leaf
+
+    Each node is visited at most twice, as such chains of mothers cannot overlap.'''
+    result = set()
+    for node in root.nodes():
+        mother = node.MyMother
+        if node.isLeaf() or mother is None or \
+           not (node.MyLeftDaughter.isLeaf() and node.MyRightDaughter.isLeaf()) or \
+           mother.MyRightDaughter is not node or not mother.MyLeftDaughter.isLeaf():
+            continue
+        collapseNode = None
+        current = node
+        while current.MyMother is not None:
+            mother = current.MyMother
+            if current.MyCostSaved == mother.MyCostSaved and mother.MyLeftDaughter.isLeaf():
+                collapseNode = mother
+            else:
+                break
+            current = mother
+        if collapseNode is not None:
+            result.add(collapseNode)
+    return result
+
+def renderTree(root, bare=False, collapse=frozenset()):
+    '''the tree in qtree notation, with each node labelled by its merge number
+    and cost saved (unless bare=True), and each node in "collapse" shown as
+    a table of its leaves'''
+    tokens = list()
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, basestring): # closing bracket
+            tokens.append(node)
+        elif node.isLeaf():
+            tokens.append(node.MyLeaf)
+        elif node in collapse:
+            leaves = node.leaves()
+            table = '{\\begin{tabular}{|ll|} \\hline ' + \
+                    ''.join([x+' \\\ ' if e % 2 else x+' & ' for (e,x) in enumerate(leaves)])
+            if len(leaves) % 2:
+                table += '\\\ \\hline \\end{tabular}} '
+            else:
+                table += ' \\hline \\end{tabular}} '
+            tokens.append(table)
+        else:
+            if bare:
+                tokens.append('[')
+            else:
+                if node.MyCostSaved < 0:
+                    costSavedStr = '{\\color{red}' + str(node.MyCostSaved) + '}'
+                else:
+                    costSavedStr = str(node.MyCostSaved)
+                tokens.append('[.{' + str(node.MyIndex) + '$_{' + costSavedStr + '}$}')
+            stack += [']', node.MyRightDaughter, node.MyLeftDaughter]
+    return ' '.join(tokens)
+
 #####################################################
 
 ####################
 ## Class Stemplex ##
 ####################
 
-class Stemplex:
-    def __init__(self, L, rowNumber, nColumns):
-        self.MyDirtyFlag = False
+class Stemplex(object):
+    # Only what stem extraction needs is set up by __init__; the targets,
+    # costs and trees used when merging stemplexes are created by
+    # initMergeState() the first time any of them is asked for.
+    __slots__ = ('MySourceRowList', 'MyRowNumberList', 'numColumns', 'shortWord',
+                 'MyStemList', 'MyAffixes', 'MyLeaveList', 'MyNodeIndex',
+                 'MyMergeStateFlag', 'MyDirtyFlag',
+                 'MyTargetsList', 'MyOriginalAffixesList',
+                 'MyGrammarCost', 'MyCostMatrixList', 'MyDataCost', 'MyTotalCost',
+                 'MyTreeNode', 'MyTree', 'MyBareTree', 'MyCollapsedBareTree', 'MyCollapsedTree',
+                 'MyImprovedSourceRowList', 'MyImprovedSourceRowSubstringDictList')
+
+    def __init__(self, L, rowNumber, nColumns, multiset=None):
+        # multiset = (multiset stem, multiset affixes) of the row if already known,
+        #            e.g. from stemBatch.MultisetLexicon
+        self.MyMergeStateFlag = False
 
         self.MySourceRowList = [L[1:]]
         self.MyRowNumberList = [rowNumber]
         self.numColumns = nColumns
 
-        # alphabetize all source words in the paradigm
-        unorderL = [unorder(x) for x in L[1:]]
-
-        # find the stem
         self.shortWord = shortest(L[1:])[0] # need shortWord for function "reorder"
-        shortWordUnorder = unorder(self.shortWord)
-        stem = ''
-        for l in shortWordUnorder:
-            AllExist = True # whether l exists in each of the words in unorderL
-            for w in unorderL:
-                if l not in w:
-                    AllExist = False
-                    break
-            if AllExist:
-                stem += l
-                unorderL = [w.replace(l,'',1) for w in unorderL]
 
-        self.MyStemList = [stem]
-        self.MyTargetsList = [[unorder(x) for x in L[1:]]]
-        self.MyOriginalAffixesList = [unorderL]
-        self.MyAffixes = unorderL
+        if multiset is None:
+            # count vectors of all source words in the paradigm
+            wordCountList = [countVector(x) for x in L[1:]]
 
-        self.MyGrammarCost = 0
-        self.MyCostMatrixList = []
-        self.MyDataCost = 0
-        self.MyTotalCost = 0
-        self.updateEverything()
+            # find the stem: letters common to all words, as many times as each word allows
+            stemCounts = multisetIntersection(wordCountList)
+            self.MyStemList = [multisetString(stemCounts)]
+            self.MyAffixes = [multisetString(multisetResidue(x, stemCounts)) for x in wordCountList]
+        else:
+            self.MyStemList = [multiset[0]]
+            self.MyAffixes = list(multiset[1])
 
         # use the first word form in the data (usually the infinitive) as the paradigm's leaf
-        self.MyTree = L[0]
-        self.MyBareTree = L[0]
-        self.MyCollapsedBareTree = L[0]
         self.MyLeaveList = [L[0]]
-        self.MyCollapsedTree = ''
 
         # encode this stemplex as a node in a tree
         self.MyNodeIndex = 0
 
     #class Stemplex------------------------------------------------------------#
 
+    def initMergeState(self):
+        # called on first use of any of the merge/tree state below
+        if self.MyMergeStateFlag:
+            return
+        self.MyMergeStateFlag = True
+        self.MyDirtyFlag = False
+
+        self.MyTargetsList = [[multisetString(countVector(x)) for x in self.MySourceRowList[0]]]
+        self.MyOriginalAffixesList = [list(self.MyAffixes)]
+        # the word forms as shown in the alignment results of printlatex;
+        # plain unless set otherwise before merging
+        self.MyImprovedSourceRowList = [list(self.MySourceRowList[0])]
+
+        self.MyGrammarCost = 0
+        self.MyCostMatrixList = []
+        self.MyDataCost = 0
+        self.MyTotalCost = 0
+        self.updateEverything()
+
+        # the tree strings are rendered from MyTreeNode when first asked for
+        self.MyTreeNode = TreeNode(self.MyLeaveList[0])
+        self.MyTree = None
+
+    #class Stemplex------------------------------------------------------------#
+
     def updateEverything(self):
         self.computeGrammarCost()
-#        self.computeCostMatrixList()
+        self.computeCostMatrixList()
         self.computeDataCost()
         self.computeTotalCost()
         self.MyDirtyFlag = False
@@ -267,11 +1038,16 @@ class Stemplex:
     def rowNums(self):
         return self.MyRowNumberList
 
+    def rowIndex(self):
+        'a new RowIndex of the source row, for the extractStem* methods'
+        return RowIndex(self.MySourceRowList[0])
+
     def sourceRows(self):
         return self.MySourceRowList
 
-#    def improvedSourceRows(self):
-#        return self.MyImprovedSourceRowList
+    def improvedSourceRows(self):
+        self.initMergeState()
+        return self.MyImprovedSourceRowList
 
 #    def improvedSourcedRowDictList(self):
 #        return self.MyImprovedSourceRowDictList
@@ -286,29 +1062,57 @@ class Stemplex:
         return self.MyStemList
 
     def targets(self):
+        self.initMergeState()
         return self.MyTargetsList
 
     def originalAffixes(self):
+        self.initMergeState()
         return self.MyOriginalAffixesList
 
     def affixes(self):
         return self.MyAffixes
 
     def tree(self):
+        self.initMergeState()
+        if self.MyTree is None:
+            self.renderTrees()
         return self.MyTree
 
     def bareTree(self):
+        self.initMergeState()
+        if self.MyTree is None:
+            self.renderTrees()
         return self.MyBareTree
 
     def collapsedBareTree(self):
+        self.initMergeState()
+        if self.MyTree is None:
+            self.renderTrees()
         return self.MyCollapsedBareTree
 
     def collapsedTree(self):
+        self.initMergeState()
+        if self.MyTree is None:
+            self.renderTrees()
         return self.MyCollapsedTree
 
+    def treeNode(self):
+        self.initMergeState()
+        return self.MyTreeNode
+
+    def renderTrees(self):
+        collapse = collapsibleNodes(self.MyTreeNode)
+        self.MyTree = renderTree(self.MyTreeNode)
+        self.MyBareTree = renderTree(self.MyTreeNode, bare=True)
+        self.MyCollapsedTree = renderTree(self.MyTreeNode, collapse=collapse)
+        if self.MyTreeNode in collapse:
+            self.MyCollapsedTree = '[ ' + self.MyCollapsedTree + ' ]'
+        self.MyCollapsedBareTree = ' '.join([x if x[0] != '[' else '[' for x in self.MyCollapsedTree.split()])
+
     #class Stemplex------------------------------------------------------------#
 
     def grammarCost(self):
+        self.initMergeState()
         if self.MyDirtyFlag:
             self.updateEverything()
         return self.MyGrammarCost
@@ -320,58 +1124,90 @@ class Stemplex:
     #class Stemplex------------------------------------------------------------#
 
     def costMatrixList(self):
+        self.initMergeState()
         if self.MyDirtyFlag:
             self.updateEverything()
         return self.MyCostMatrixList
 
-#    def computeCostMatrixList(self):
-#        matrixList = list()
-#        for (e, stem) in enumerate(self.MyStemList):
-#            matrixForEachStem = numpy.zeros((self.numColumns,5), dtype=int)
-#            try:
-#                for k in range(self.numColumns):
-#                    matrixForEachStem[k] = cost(stem, self.MyAffixes[k], self.MyTargetsList[e][k])
-#            except:
-#                print 'self.MySourceRowList', self.MySourceRowList
-#                print 'matrixForEachStem', matrixForEachStem
-#                print 'e', e
-#                print 'k', k
-#                print 'self.numColumns', self.numColumns
-#                print 'self.MyAffixes', self.MyAffixes
-#                print 'self.MyTargetsList', self.MyTargetsList
-#                print 'self.MyAffixes[k]', self.MyAffixes[k]
-#                print 'matrixForEachStem[k]', matrixForEachStem[k]
-#                print 'self.MyTargetsList[e][k]', self.MyTargetsList[e][k]
-#                raw_input()
-#            matrixList.append(matrixForEachStem.T)
-#        self.MyCostMatrixList =  matrixList
+    def computeCostMatrixList(self):
+        # one 5 x numColumns matrix per stem, all computed together
+        self.MyCostMatrixList = costMatrices(self.MyStemList, self.MyAffixes, self.MyTargetsList)
 
     #class Stemplex------------------------------------------------------------#
 
     def dataCost(self):
+        self.initMergeState()
         if self.MyDirtyFlag:
             self.updateEverything()
         return self.MyDataCost
 
     def computeDataCost(self):
-        self.MyDataCost = sum([matrixForEachStem.sum() for matrixForEachStem in self.costMatrixList()])
+        self.MyDataCost = sum([matrixSum(matrixForEachStem) for matrixForEachStem in self.MyCostMatrixList])
 
     #class Stemplex------------------------------------------------------------#
 
     def totalCost(self):
+        self.initMergeState()
         if self.MyDirtyFlag:
             self.updateEverything()
         return self.MyTotalCost
 
     def computeTotalCost(self):
-        self.MyTotalCost = self.grammarCost() + self.dataCost()
+        self.MyTotalCost = self.MyGrammarCost + self.MyDataCost
+
+    def mergeCosts(self, stmplx, alignmentList):
+        '''returns the total cost that self would have if merged with stmplx,
+        for each alignment in alignmentList (each one as newAlignment in
+        merge(): a permutation of the columns of stmplx), computed for all
+        the alignments together and without merging anything'''
+        self.initMergeState()
+        stmplx.initMergeState()
+        stemList = self.MyStemList + stmplx.stems()
+        stemLength = len(''.join(stemList))
+
+        if numpy is None:
+            result = list()
+            for newAlignment in alignmentList:
+                affixList = createUnionAffixes([self.MyAffixes, [stmplx.affixes()[i] for i in newAlignment]])
+                targetsList = self.MyTargetsList + [[s[i] for i in newAlignment] for s in stmplx.targets()]
+                dataCost = sum([matrixSum(m) for m in costMatrices(stemList, affixList, targetsList)])
+                result.append(LAMBDA_BITS * (stemLength + len(''.join(affixList)) + self.numColumns) + dataCost)
+            return result
+
+        letterIndex = letterIndexOf(stemList + self.MyAffixes + stmplx.affixes() +
+                                    [''.join(x) for x in self.MyTargetsList + stmplx.targets()])
+        nLetters = len(letterIndex)
+        alignments = numpy.array(alignmentList, dtype=int).reshape(-1, self.numColumns)
+        nAlignments = alignments.shape[0]
+
+        # targets of the merged stemplex, for each alignment: (alignments, stems, columns, letters)
+        selfTargets = numpy.array([countArray(x, letterIndex) for x in self.MyTargetsList]).reshape(
+            len(self.MyTargetsList), self.numColumns, nLetters)
+        otherTargets = numpy.array([countArray(x, letterIndex) for x in stmplx.targets()]).reshape(
+            len(stmplx.targets()), self.numColumns, nLetters)
+        targetCounts = numpy.concatenate(
+            [numpy.broadcast_to(selfTargets, (nAlignments,) + selfTargets.shape),
+             otherTargets[:, alignments].transpose(1, 0, 2, 3)], axis=1)
+
+        # union affixes (per-letter maximum), for each alignment: (alignments, columns, letters)
+        affixCounts = numpy.maximum(countArray(self.MyAffixes, letterIndex)[numpy.newaxis],
+                                    countArray(stmplx.affixes(), letterIndex)[alignments])
+
+        matrices = costArrays(countArray(stemList, letterIndex), affixCounts, targetCounts)
+        dataCosts = matrices.sum(axis=(1, 2, 3))
+        grammarCosts = LAMBDA_BITS * (stemLength + affixCounts.sum(axis=(1, 2)) + self.numColumns)
+        return [int(x) for x in grammarCosts + dataCosts]
 
     #class Stemplex------------------------------------------------------------#
 
 
-    def merge(self, stmplx, newAlignment, mergeCount=None, costSaved=None, nodeDict=None, leftLeaves=None, rightLeaves=None):
+    def merge(self, stmplx, newAlignment, mergeCount=None, costSaved=None):
         # When mergeCount==None, this merge() function is only *pretending* to merge two stemplexes,
         # because in this case the focus is the total cost (if merged), not really doing the merge.
+        # (mergeCosts() gives that cost without touching either stemplex.)
+
+        self.initMergeState()
+        stmplx.initMergeState()
 
         self.MyLeaveList += stmplx.leaves()
         self.MyStemList += stmplx.stems()
@@ -386,130 +1222,15 @@ class Stemplex:
         # The second affix list is in its new alignment.
         self.MyAffixes = createUnionAffixes([self.affixes(), [stmplx.affixes()[i] for i in newAlignment]])
 
-        self.updateEverything()
-
-        if costSaved < 0:
-            costSavedStr = '{\\color{red}' + str(costSaved) + '}'
-        else:
-            costSavedStr = str(costSaved)
-
-        self.MyTree = '[.{' + str(mergeCount) + '$_{' + costSavedStr + '}$} ' + self.MyTree + ' ' + stmplx.tree() + ' ]'
-        self.MyBareTree = '[ ' + self.MyBareTree + ' ' + stmplx.bareTree() + ' ]'
+        # costs are recomputed when next asked for
+        self.MyDirtyFlag = True
 
-        # updating tree node information
-#        self.MyNodeDaughters = (self.MyNodeIndex, stmplx.MyNodeIndex)
+        # updating tree node information; the tree strings are rendered when next asked for
+        self.MyTreeNode = TreeNode(index=mergeCount, leftDaughter=self.MyTreeNode,
+                                   rightDaughter=stmplx.treeNode(), costSaved=costSaved)
+        self.MyTree = None
         self.MyNodeIndex = mergeCount
 
-
-        if nodeDict:
-
-            self.MyCollapsedTree = self.MyTree
-
-            ###################################################################
-            # create a collapsed tree, where paradigms that are morphologically
-            # identical collapse if the following two conditions are met:
-            #   1. they all are in the same subtree in self.MyTree
-            #   2. their saved costs at each mother node inside are the same
-            ###################################################################
-
-            # locate nodes which:
-            #  1. have only one leaf as left daughter and only one leaf as right daughter
-            #  2. are the *right* daughter of another node
-            #  3. have a sister node that consists only of one single leaf
-            #
-            #        mother
-            #         /  \
-            #      leaf  *SELF* <== locate
-            #             /  \
-            #           leaf  leaf
-
-            candidateNodeList = list()
-
-            for k in filter(lambda x: x < ROWS, nodeDict.keys()):
-                print 'k', k
-                print 'nodeDict[k].MyLeftDaughterLeaves', nodeDict[k].MyLeftDaughterLeaves
-                print 'nodeDict[k].MyRightDaughterLeaves', nodeDict[k].MyRightDaughterLeaves
-                print 'nodeDict[k].MyMother', nodeDict[k].MyMother
-                if (nodeDict[k].MyLeftDaughterLeaves and nodeDict[k].MyRightDaughterLeaves and nodeDict[k].MyMother) and \
-                   (len(nodeDict[k].MyLeftDaughterLeaves) == len(nodeDict[k].MyRightDaughterLeaves) == 1) and \
-                   (nodeDict[nodeDict[k].MyMother].MyRightDaughter == k) and \
-                   (len(nodeDict[nodeDict[k].MyMother].MyLeftDaughterLeaves) == 1):
-                    candidateNodeList.append(k)
-
-            print '\ncandidateNodeList', candidateNodeList
-
-            collapseNodeList = [0] * len(candidateNodeList)
-            # ^-- will contain the node indices for nodes to collapse, after the following for-loop
-
-            for (e,k) in enumerate(candidateNodeList):
-                currentNodeIndex = k
-                currentNodeCostSaved = nodeDict[k].MyCostSaved
-
-                while True and nodeDict[currentNodeIndex].MyMother:
-                    motherNodeIndex = nodeDict[currentNodeIndex].MyMother
-                    motherNodeCostSaved = nodeDict[nodeDict[currentNodeIndex].MyMother].MyCostSaved
-
-                    # if...
-                    #    1. my own cost saved == my mum's cost saved
-                    #    2. my sister consists only of a single leaf
-                    # then:
-                    #    signal the merging of my mum and myself
-                    # else:
-                    #    leave this while loop
-
-                    if (currentNodeCostSaved == motherNodeCostSaved) and \
-                       (len(nodeDict[motherNodeIndex].MyLeftDaughterLeaves) ==  1):
-                        collapseNodeList[e] = motherNodeIndex
-                    else:
-                        break
-
-                    currentNodeIndex = motherNodeIndex
-                    currentNodeCostSaved = motherNodeCostSaved
-
-            print '\ncollapseNodeList:'
-            print collapseNodeList#; raw_input()
-
-            # collapseNodeList contains node indices for nodes to collapse
-            # if node index == 0 in collapseNodeList, ignore it. (No node index can be 0.)
-
-            # for each node to collapse
-            #     find the corresponding subtree '[ ... ]' in self.MyTree (use technique of matching parentheses)
-
-            for nodeIndex in filter(lambda x: x, collapseNodeList):
-                search_str = '[.{' + str(nodeIndex) + '$'
-                try:
-                    subtree = self.MyTree[self.MyTree.index(search_str):]
-                except ValueError: # when this nodeIndex is not relevant to the current merge
-                    continue
-
-                paren_count = 0
-                for (e,char) in enumerate(subtree):
-                    if char == '[':
-                        paren_count += 1
-                    elif char == ']':
-                        paren_count -= 1
-                    if paren_count == 0:
-                        matchParenIndex = e
-                        break
-
-                replacee = subtree[:matchParenIndex+1]
-
-#                print '\nreplacee', replacee; raw_input()
-
-                replacer = '{\\begin{tabular}{|ll|} \\hline ' + \
-                            ''.join([x+' \\\ ' if e % 2 else x+' & ' for (e,x) in enumerate(nodeDict[nodeIndex].MyDaughterLeaves)]) + \
-                            '#\\hline \\end{tabular}} '
-                if len(nodeDict[nodeIndex].MyDaughterLeaves) % 2:
-                    replacer = replacer.replace('#','\\\ ')
-                else:
-                    replacer = replacer.replace('#',' ')
-
-                self.MyCollapsedTree = self.MyCollapsedTree.replace(replacee, replacer)
-                if '[' not in self.MyCollapsedTree:
-                    self.MyCollapsedTree = '[ ' + self.MyCollapsedTree + ' ]'
-
-        self.MyCollapsedBareTree = ' '.join([x if x[0] != '[' else '[' for x in self.MyCollapsedTree.split()])
-
     #class Stemplex------------------------------------------------------------#
 
     def printTerminal(self):
@@ -596,13 +1317,13 @@ class Stemplex:
 
             # print costMatrix
             costMatrix = self.costMatrixList()[e]
-            wordDataCostVector = costMatrix.sum(axis=0) # axis=0 to get vertical sums
+            wordDataCostVector = [sum(x) for x in zip(*costMatrix)] # vertical sums
             for line in costMatrix: # there are 5 lines in self.costMatrixList()[e]
                 for pointCost in line: # pointCost = cell cost in costMatrix
                     latexfile.write('& & %d ' % (pointCost))
                 latexfile.write('\\\ \n')
             latexfile.write('\\midrule\n')
-            latexfile.write('{\\color{blue} %d} ' % (self.costMatrixList()[e].sum()))
+            latexfile.write('{\\color{blue} %d} ' % (matrixSum(costMatrix)))
             for wordDataCost in wordDataCostVector:
                 latexfile.write('& & %d ' % (wordDataCost))
             latexfile.write('\\\ \n')
@@ -641,7 +1362,28 @@ class Stemplex:
     #
     ################################################################################
 
-    def extractStemSubstring(self):
+    def extractStemSubstring(self, engine='auto', counters=None, budget=None, rowIndex=None):
+        # engine = 'enumerate' (every substring of shortWord, from the longest down),
+        #          'automaton' (generalized suffix automaton) or 'auto' (the default):
+        #          enumerating is the faster whenever the words share a long substring,
+        #          which is what stems usually are (e.g. 0.0001s vs 0.0178s for a root of
+        #          length 100 in 20 forms, 0.0013s vs 0.1455s at length 1000); it only loses
+        #          when the longest common substring is much shorter than the words
+        #          (unrelated forms of length 200 or more: 0.2049s vs 0.0197s at length
+        #          400, 3.06s vs 0.05s at length 1000), as it then tries O(length^2)
+        #          candidates, each checked in O(length) per form. So 'auto' enumerates, and
+        #          switches to the automaton once the letters scanned by its checks (plus
+        #          SUBSTRING_CHECK_COST per check) exceed SUBSTRING_WORK_FACTOR times the
+        #          letters of the row: as a letter scanned by str.find costs about 1/6000
+        #          of a letter added to the (pure Python) automaton, the abandoned
+        #          enumeration then costs a bounded fraction of the automaton's time (at
+        #          most about half of it in measurements, e.g. 0.041s vs 0.028s).
+        # counters = dict for the number of candidates tried (None = not counted); those
+        #          of an enumeration abandoned for the automaton go to 'abandonedCandidates'
+        # budget = a Budget to spend per candidate stem when enumerating; once it is used
+        #          up, the automaton (linear in the length of the words, not limited) gives
+        #          the same result
+        # rowIndex = self.rowIndex(), if already made for another strategy
         resultDict = dict()
         sourceRow = self.MySourceRowList[0]
 
@@ -654,7 +1396,20 @@ class Stemplex:
             resultDict[''] = resultWordMasterList
             return resultDict
 
+        if engine == 'automaton':
+            substringDict = longestCommonSubstrings(sourceRow, counters)
+            # same insertion order as the reference mode: by position in shortWord
+            for possibleStem in sorted(substringDict, key=self.shortWord.index):
+                resultDict[possibleStem] = [[tuple(range(x, x+len(possibleStem))) for x in starts]
+                                            for starts in substringDict[possibleStem]]
+            return resultDict
+        elif engine not in ('enumerate', 'auto'):
+            raise ValueError('unknown substring engine: %s' % (engine))
+
         longestLength = 0
+        nCandidates = 0
+        work = 0
+        workLimit = SUBSTRING_WORK_FACTOR * sum([len(x) for x in sourceRow])
 
         for k in range(len(self.shortWord), -1, -1): # k = length of stem
             if k <= longestLength:
@@ -668,36 +1423,58 @@ class Stemplex:
                                 for i in range(numOfPossibleStems)]
 
             for possibleStem in possibleStemList:
+                nCandidates += 1
+                if budget is not None and not longestLength:
+                    try:
+                        budget.spend()
+                    except BudgetExceeded:
+                        addCount(counters, 'abandonedCandidates', nCandidates)
+                        return self.extractStemSubstring('automaton', counters, rowIndex=rowIndex)
                 goodStem = True # whether a possible stem is a substring common
                                 # to ALL words in a paradigm
                 for sourceWord in sourceRow:
+                    work += len(sourceWord) + SUBSTRING_CHECK_COST
                     if possibleStem not in sourceWord:
                         goodStem = False
                         break
 
+                if engine == 'auto' and not longestLength and work > workLimit:
+                    addCount(counters, 'abandonedCandidates', nCandidates)
+                    return self.extractStemSubstring('automaton', counters, rowIndex=rowIndex)
+
                 if goodStem:
                     resultList = list()
                     if not longestLength:
                         longestLength = len(possibleStem)
 
-                    # get indices in source words
-                    for sourceWord in sourceRow:
+                    # get indices in source words: the positions of the stem's first
+                    # letter at which the whole stem starts
+                    if rowIndex is None:
+                        rowIndex = self.rowIndex()
+                    for (sourceWord, positions) in zip(sourceRow, rowIndex.positions()):
                         indexTuplesList = [tuple(range(x,x+len(possibleStem)))
-                                           for x in locateByIndex(sourceWord, possibleStem)]
+                                           for x in positions[possibleStem[0]]
+                                           if sourceWord.startswith(possibleStem, x)]
                         resultList.append(indexTuplesList)
 
                     resultDict[possibleStem] = resultList
+        addCount(counters, 'candidates', nCandidates)
         return resultDict
 
 
     #class Stemplex------------------------------------------------------------#
 
 
-    def extractStemMultiset(self):
+    def extractStemMultiset(self, lazy=False, countOnly=False, counters=None, budget=None, rowIndex=None):
+        # lazy = True: each word's index tuples are given as a generator
+        # countOnly = True: each word gets the number of its index tuples instead
+        # counters = dict for the numbers of candidates and combinations (None = not counted)
+        # budget = a Budget to spend per index tuple (lists, never lazy); once it is
+        #          used up, the index tuples are truncated (see takeAlignments)
+        # rowIndex = self.rowIndex(), if already made for another strategy
         resultDict = dict()
         sourceRow = self.MySourceRowList[0]
         multisetStem = self.MyStemList[0]
-        multisetStemSet = list(set(multisetStem))
 
         # if the shortest multiset stem is a null string, then the paradigm is completely suppletive
         if self.MyStemList[0] == '':
@@ -705,47 +1482,35 @@ class Stemplex:
             resultWordMasterList = list()
             for i in range(len(sourceRow)):
                 resultWordMasterList.append(sourceWordsIndexList[i])
+            if countOnly:
+                resultWordMasterList = [len(x) for x in resultWordMasterList]
             resultDict[''] = resultWordMasterList
             return resultDict
 
-        # stemIndicesMasterList =
-        # [
-        #     [ <= indexList, for a source word
-        #         [ (indices), (indices) ], <= list(NChooseKCombos), for a particular stem character
-        #         [ (indices) ] ...
-        #     ]
-        # ]
-        stemIndicesMasterList = list()
-        for sourceWord in sourceRow:
-            indexList = list()
-
-            for stemChar in multisetStemSet:
-                numOfStemCharInStem = multisetStem.count(stemChar)
-                stemCharIndexList = locateByIndex(sourceWord, stemChar)
-
-                NChooseKCombos = itertools.combinations(stemCharIndexList, numOfStemCharInStem)
-                indexList.append(list(NChooseKCombos))
-
-            stemIndicesMasterList.append(indexList)
-
-        resultList = list()
-        for (sourceWord, stemIndicesList) in zip(sourceRow, stemIndicesMasterList):
-            LCM = lcmm(map(len, stemIndicesList)) # least common multiple among lengths
-                                                  # = number of source word patterns
-
-            indexMatrix = list()
-            for stemIndices in stemIndicesList:
-                factor = LCM / len(stemIndices)
-                indexMatrix.append( stemIndices * factor )
-
-            indexTuplesList = list()
-            for i in range(LCM):
-                indexTuple = tuple()
-                for stemCharIndices in indexMatrix:
-                    indexTuple = indexTuple + stemCharIndices[i]
-                indexTuplesList.append(tuple(sorted(indexTuple)))
-
-            resultList.append(indexTuplesList)
+        if rowIndex is None:
+            rowIndex = self.rowIndex()
+        if counters is not None:
+            # one candidate stem; each stem letter's combinations of positions in each word
+            stemCounts = countVector(multisetStem)
+            addCount(counters, 'candidates', 1)
+            for wordCounts in rowIndex.counts():
+                addCount(counters, 'combinations',
+                         sum([choose(wordCounts.get(l, 0), c) for (l, c) in stemCounts.items()
+                              if wordCounts.get(l, 0) >= c]))
+
+        if budget is not None and not countOnly:
+            resultList = takeAlignments([multisetAlignments(sourceWord, multisetStem, positions)
+                                         for (sourceWord, positions) in zip(sourceRow, rowIndex.positions())],
+                                        budget)
+        else:
+            resultList = list()
+            for (sourceWord, wordCounts, positions) in zip(sourceRow, rowIndex.counts(), rowIndex.positions()):
+                if countOnly:
+                    resultList.append(countMultisetAlignments(sourceWord, multisetStem, wordCounts))
+                elif lazy:
+                    resultList.append(multisetAlignments(sourceWord, multisetStem, positions))
+                else:
+                    resultList.append(list(multisetAlignments(sourceWord, multisetStem, positions)))
 
         resultDict[multisetStem] = resultList
 
@@ -755,11 +1520,20 @@ class Stemplex:
     #class Stemplex------------------------------------------------------------#
 
 
-    def extractStemSubsequence(self):
+    def extractStemSubsequence(self, engine='dp', lazy=False, cap=None, counters=None, budget=None,
+                               rowIndex=None):
+        # engine = 'dp' (dynamic programming) or 'enumerate' (reference mode)
+        # lazy = True: each word's index tuples are given as a generator
+        # cap = maximum number of index tuples per word (None = no limit)
+        # counters = dict for the numbers of candidates and combinations (None = not counted)
+        # budget = a Budget to spend per search state or candidate stem, then per index
+        #          tuple (lists, never lazy); if it is used up while looking for the stems,
+        #          the longest common substrings are given instead (they are common
+        #          subsequences too), and if while listing index tuples, these are
+        #          truncated (see takeAlignments) and no further stems are listed
+        # rowIndex = self.rowIndex(), if already made for another strategy
         resultDict = dict()
         sourceRow = self.MySourceRowList[0]
-        goodStemList = list()
-        longestLength = 0
 
         # if the shortest multiset stem is a null string, then the paradigm is completely suppletive
         if self.MyStemList[0] == '':
@@ -771,46 +1545,31 @@ class Stemplex:
             return resultDict
 
         # find all good stem subsequences => goodStemList
-        for k in range(len(self.shortWord), -1, -1): # k = length of stem
-            if k <= longestLength:
-                break
-
-            possibleStemList = list(itertools.combinations(self.shortWord, k))
-
-            for possibleStem in possibleStemList: # type(possibleStem) = tuple
-                for sourceWord in sourceRow:
-                    NChooseKCombos = list(itertools.combinations(sourceWord, k))
-                    if possibleStem not in NChooseKCombos:
-                        break
-                else:
-                    goodStemList.append(''.join(possibleStem))
-                    if not longestLength:
-                        longestLength = len(possibleStem)
-
-        #### work from here ####
-        #### at this indentation level ###
-
-        for stemSubsequence in goodStemList: # type(stemSubsequence) = tuple
+        try:
+            if engine == 'dp':
+                goodStemList = longestCommonSubsequences(sourceRow, counters, budget)
+            elif engine == 'enumerate':
+                goodStemList = enumerateCommonSubsequences(self.shortWord, sourceRow, counters, budget)
+            else:
+                raise ValueError('unknown subsequence engine: %s' % (engine))
+        except BudgetExceeded:
+            budget.marker = FALLBACK_SUBSTRING
+            return self.extractStemSubstring(counters=counters, rowIndex=rowIndex)
+
+        if rowIndex is None:
+            rowIndex = self.rowIndex()
+        for stemSubsequence in goodStemList: # type(stemSubsequence) = str
+            if budget is not None and budget.marker is not None:
+                break # there may be exponentially many stems
             resultList = list()
 
-            for sourceWord in sourceRow:
-                wordResultList = list()
-                stemCharIndexInWordList = list()
-
-                for stemChar in stemSubsequence:
-                    stemCharIndexInWordList.append(locateByIndex(sourceWord, stemChar))
-
-                stemIndicesInWordList = list(itertools.product(*stemCharIndexInWordList))
-
-                for stemIndicesInWord in stemIndicesInWordList:
-
-                    for i in range(len(stemIndicesInWord)-1):
-                        if not (stemIndicesInWord[i] < stemIndicesInWord[i+1]):
-                            break
-                    else:
-                        wordResultList.append(stemIndicesInWord)
-
-                resultList.append(wordResultList)
+            for (sourceWord, positions) in zip(sourceRow, rowIndex.positions()):
+                wordResults = subsequenceAlignments(sourceWord, stemSubsequence, cap, positions)
+                if not lazy and budget is None:
+                    wordResults = list(wordResults)
+                resultList.append(wordResults)
+            if budget is not None:
+                resultList = takeAlignments(resultList, budget)
 
             stemStr = ''.join(stemSubsequence)
             resultDict[stemStr] = resultList